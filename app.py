@@ -1,116 +1,494 @@
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash
+from flask import Flask, current_app, render_template, request, send_file, redirect, url_for, flash, jsonify, make_response, session, Response, stream_with_context
+import json
+import time
 import logging
-import tempfile
 import os
 
-from .youtube_utils import search_youtube, format_duration 
-from .excel_utils import save_to_excel
+from .youtube_utils import search_youtube, iter_search_youtube, format_duration, get_cache_stats, thumbnail_file, extract_video_id, SearchFailed, SEARCH_MODES, SEARCH_MODE_COMBINED, RANKINGS, RANKING_RECENT
+from .export_utils import iter_csv_chunks, iter_ndjson_chunks, iter_parquet_chunks
+from .jobs_utils import ExportJobManager, result_set_key, JOB_DONE, JOB_FAILED
+from .cache_utils import QueryResultCache, normalize_query_key
+from .results_utils import ResultStore
+from .ratelimit_utils import UpstreamUnavailable
+from .thumbnail_utils import THUMBNAIL_VARIANTS, THUMBNAIL_HTTP_MAX_AGE
+from .metrics_utils import REGISTRY, timed, begin_request_timing, end_request_timing, render_metrics
 
-app = Flask(__name__)
-app.secret_key = os.urandom(24) # Needed for flash messages
+def _env_flag(name, default=False):
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes')
 
-# Configure basic logging for the app as well
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def _env_int(name, default):
+    try:
+        return int(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+def config_from_env():
+    """App settings, each overridable by the environment variable of the same name."""
+    return {
+        # Needed for flash messages and the session. Set SECRET_KEY when running several
+        # workers without preloading so they all accept each other's session cookies.
+        'SECRET_KEY': os.environ.get('SECRET_KEY') or os.urandom(24),
+        # Bounds applied to the requested number of results
+        'MIN_RESULTS': _env_int('MIN_RESULTS', 5),
+        'MAX_RESULTS': _env_int('MAX_RESULTS', 20),
+        # Log a per-stage timing breakdown for every request (LOG_REQUEST_TIMINGS=1)
+        'LOG_REQUEST_TIMINGS': _env_flag('LOG_REQUEST_TIMINGS'),
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'INFO').upper(),
+        # Run the warm-up hooks in create_app (WARM_UP=1); the preload worker mode turns this on
+        'WARM_UP': _env_flag('WARM_UP'),
+    }
+
+# Server-side store of search results for Excel export, keyed by result-set ID.
+# The ID is carried in the download link and remembered in the user's session.
+result_store = ResultStore()
+
+# Export files are built in the background and cached on disk by result-set hash,
+# so downloads are served as files. The Excel report of each search is started
+# speculatively when the search finishes, behind any explicitly requested export
+export_jobs = ExportJobManager(format_duration_func=format_duration)
+
+# Streamed export formats: chunk generator, file extension and content type
+STREAMED_EXPORTS = {
+    'csv': (iter_csv_chunks, 'csv', 'text/csv; charset=utf-8'),
+    'ndjson': (iter_ndjson_chunks, 'ndjson', 'application/x-ndjson'),
+    'parquet': (iter_parquet_chunks, 'parquet', 'application/vnd.apache.parquet'),
+}
+
+# Short-lived cache of whole search results; identical concurrent searches share one pipeline
+query_cache = QueryResultCache()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'ytt_http_request_duration_seconds', 'Duration of HTTP requests in seconds.', labelnames=('endpoint', 'status'))
+REGISTRY.gauge_callback(
+    'ytt_video_cache_events', 'Video details cache counters since process start.',
+    lambda: {(event,): value for event, value in get_cache_stats().items()}, labelnames=('event',))
+
+# View functions and warm-up hooks, registered on every app built by create_app
+_routes = [] # (rule, view function, add_url_rule options)
+_warm_up_hooks = []
+
+def route(rule, **options):
+    """Like app.route, for the views create_app registers."""
+    def decorator(view_func):
+        _routes.append((rule, view_func, options))
+        return view_func
+    return decorator
+
+def warm_up_hook(func):
+    """Registers func(app) to run when create_app warms up (WARM_UP=1)."""
+    _warm_up_hooks.append(func)
+    return func
+
+def _start_request_timing():
+    request.environ['ytt.started'] = time.perf_counter()
+    begin_request_timing()
+
+def _finish_request_timing(response):
+    started = request.environ.get('ytt.started')
+    timings = end_request_timing()
+    if started is None:
+        return response
+    duration = time.perf_counter() - started
+    REQUEST_DURATION.observe(duration, endpoint=request.endpoint or 'unknown', status=response.status_code)
+    if current_app.config['LOG_REQUEST_TIMINGS']:
+        # Streamed responses are still running here; their stages are only in /metrics.
+        # Stages run on worker threads are summed over the threads, so can exceed the request time
+        breakdown = ', '.join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in sorted(timings.items()))
+        current_app.logger.info(f"{request.method} {request.path} {response.status_code} in {duration * 1000:.0f}ms ({breakdown or 'no stages'})")
+    return response
+
+def _render(template_name, **context):
+    with timed('render'):
+        return render_template(template_name, **context)
+
+def _search_mode(value):
+    # Unknown or missing modes fall back to the single combined query
+    return value if value in SEARCH_MODES else SEARCH_MODE_COMBINED
 
-# Global variable to store the latest video search results for Excel export
-latest_videos_data = []
+def _ranking(value):
+    return value if value in RANKINGS else RANKING_RECENT
 
-@app.route('/')
+def thumbnail_url(video, variant='grid'):
+    # Template helper: the /thumb URL for a video's thumbnail, or its upstream URL without a video ID
+    video_id = extract_video_id(video.url)
+    if video_id:
+        return url_for('thumbnail', video_id=video_id, variant=variant)
+    if video.thumbnail and video.thumbnail.startswith(('http://', 'https://')):
+        return video.thumbnail
+    return None
+
+def _with_cache_headers(html, cache_status, cache_age):
+    response = make_response(html)
+    response.headers['X-Cache'] = cache_status
+    response.headers['X-Cache-Age'] = str(int(cache_age))
+    return response
+
+@route('/')
 def index():
     # Clear previous search results/errors if any, by not passing them
     return render_template('index.html')
 
-@app.route('/search', methods=['POST'])
+@route('/search', methods=['POST'])
 def search_results():
-    global latest_videos_data # Declare intent to modify global variable
     if request.method == 'POST':
         keywords_str = request.form.get('keywords', '')
         try:
             max_results = int(request.form.get('max_results', 20))
         except ValueError:
             max_results = 20
+        search_mode = _search_mode(request.form.get('search_mode'))
+        ranking = _ranking(request.form.get('ranking'))
         
         if not keywords_str.strip():
             flash("Please enter at least one keyword.", "error")
-            return render_template('index.html', keywords=keywords_str, max_results=max_results)
+            return render_template('index.html', keywords=keywords_str, max_results=max_results, search_mode=search_mode, ranking=ranking)
 
         keywords_list = [k.strip() for k in keywords_str.split(",") if k.strip()]
         if not keywords_list:
             flash("Please enter valid keywords.", "error")
-            return render_template('index.html', keywords=keywords_str, max_results=max_results)
+            return render_template('index.html', keywords=keywords_str, max_results=max_results, search_mode=search_mode, ranking=ranking)
 
-        max_results = max(5, min(max_results, 20))
+        max_results = max(current_app.config['MIN_RESULTS'], min(max_results, current_app.config['MAX_RESULTS']))
         
-        app.logger.info(f"Search initiated for keywords: '{keywords_str}' with max_results: {max_results}")
+        current_app.logger.info(f"Search initiated for keywords: '{keywords_str}' with max_results: {max_results}, mode: {search_mode}, ranking: {ranking}")
+
+        if request.form.get('stream'):
+            # Progressive mode: open the results page right away and stream the
+            # videos in over server-sent events from /search/events
+            return render_template('results.html',
+                                   streaming=True,
+                                   events_url=url_for('search_events', keywords=keywords_str, max_results=max_results, search_mode=search_mode, ranking=ranking),
+                                   keywords=keywords_str,
+                                   max_results=max_results,
+                                   videos=[])
 
         try:
-            videos = search_youtube(keywords_list, max_results=max_results)
-            latest_videos_data = videos # Store results for potential Excel export
+            cache_key = normalize_query_key(keywords_list, max_results, search_mode, ranking)
+            try:
+                videos, cache_status, cache_age = query_cache.get_or_compute(
+                    cache_key, lambda: search_youtube(list(cache_key[0]), max_results=max_results,
+                                                      mode=search_mode, ranking=ranking)
+                )
+            except (UpstreamUnavailable, SearchFailed):
+                # YouTube is throttling us, the circuit is open or the search errored: fall back to an expired result if we have one
+                stale = query_cache.peek(cache_key, allow_stale=True)
+                if stale is None:
+                    raise
+                videos, cache_age = stale
+                cache_status = 'STALE'
+            # Store results for potential Excel export
+            result_id = result_store.put(videos) if videos else None
+            session['result_id'] = result_id
+            if videos:
+                export_jobs.submit(videos, 'xlsx', speculative=True) # Likely ready by the time the link is clicked
+            current_app.logger.info(f"Search cache {cache_status} for keywords: '{keywords_str}' (age {cache_age:.0f}s)")
             
             if not videos:
-                app.logger.info(f"No videos found for keywords: {keywords_str}")
-                return render_template('results.html', 
+                current_app.logger.info(f"No videos found for keywords: {keywords_str}")
+                return _with_cache_headers(_render('results.html', 
                                        message="No videos found for your query. Try different keywords.", 
                                        keywords=keywords_str, 
                                        max_results=max_results, 
-                                       videos=[])
+                                       videos=[],
+                                       result_id=result_id,
+                                       cache_status=cache_status,
+                                       cache_age=cache_age), cache_status, cache_age)
             
-            app.logger.info(f"Found {len(videos)} videos for keywords: {keywords_str}")
-            return render_template('results.html', 
+            current_app.logger.info(f"Found {len(videos)} videos for keywords: {keywords_str}")
+            return _with_cache_headers(_render('results.html', 
                                    videos=videos, 
                                    keywords=keywords_str, 
                                    max_results=max_results, 
-                                   format_duration=format_duration)
+                                   format_duration=format_duration,
+                                   result_id=result_id,
+                                   cache_status=cache_status,
+                                   cache_age=cache_age), cache_status, cache_age)
+        except UpstreamUnavailable as e:
+            current_app.logger.warning(f"Search for keywords '{keywords_str}' shed: {e}")
+            flash("YouTube is limiting our requests right now. Please try again in a minute.", "error")
+            session.pop('result_id', None)
+            response = make_response(render_template('index.html',
+                                                     keywords=keywords_str,
+                                                     max_results=max_results,
+                                                     search_mode=search_mode,
+                                                     ranking=ranking), 503)
+            response.headers['Retry-After'] = str(int(e.retry_after or 60))
+            return response
         except Exception as e:
-            app.logger.error(f"An error occurred during search for keywords '{keywords_str}': {str(e)}", exc_info=True)
+            current_app.logger.error(f"An error occurred during search for keywords '{keywords_str}': {str(e)}", exc_info=True)
             flash(f"An unexpected error occurred during the search. Please try again later.", "error")
-            latest_videos_data = [] # Clear data on error
+            session.pop('result_id', None) # Clear data on error
             return render_template('index.html', 
                                    keywords=keywords_str,
-                                   max_results=max_results)
+                                   max_results=max_results,
+                                   search_mode=search_mode,
+                                   ranking=ranking)
+
+def _sse(event, data):
+    """Formats one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _search_event_stream(keywords_str, keywords_list, max_results, search_mode, ranking):
+    """
+    Runs the search pipeline and yields server-sent events for the streaming results page:
+    'video' carries a rendered table row, 'done' carries the final
+    row order plus the download links and top-3 section, 'search_error' a message.
+    """
+    try:
+        cache_key = normalize_query_key(keywords_list, max_results, search_mode, ranking)
+        streamed = False
+        try:
+            # Goes through the same in-flight coalescing as /search: if an identical
+            # search is already running, wait for it and replay its result
+            videos, cache_status, cache_age = query_cache.begin(cache_key)
+            if cache_status == 'MISS':
+                in_flight = videos
+                videos = []
+                try:
+                    for event, payload in iter_search_youtube(list(cache_key[0]), max_results=max_results,
+                                                         mode=search_mode, ranking=ranking):
+                        if event == 'video':
+                            yield _sse(event, {'key': payload.url, 'html': render_template('_video_row.html', video=payload, format_duration=format_duration)})
+                        elif event == 'done':
+                            videos = payload
+                except Exception as e:
+                    query_cache.finish(cache_key, in_flight, error=e)
+                    raise
+                except BaseException:
+                    # The client went away mid-stream (GeneratorExit): not a failure,
+                    # so a waiting search takes over instead of getting an error
+                    query_cache.abandon(cache_key, in_flight)
+                    raise
+                query_cache.finish(cache_key, in_flight, videos)
+                streamed = True
+        except (UpstreamUnavailable, SearchFailed) as e:
+            # Raised before any video is streamed; fall back to an expired result if we have one
+            cached = query_cache.peek(cache_key, allow_stale=True)
+            if cached is None and isinstance(e, SearchFailed):
+                raise
+            if cached is None:
+                current_app.logger.warning(f"Streamed search for keywords '{keywords_str}' shed: {e}")
+                yield _sse('search_error', {'message': "YouTube is limiting our requests right now. Please try again in a minute."})
+                return
+            current_app.logger.warning(f"Search upstream unavailable ({e}); streaming stale results for: '{keywords_str}'")
+            videos, cache_age = cached
+            cache_status = 'STALE'
+        if not streamed:
+            current_app.logger.info(f"Search cache {cache_status} for streamed keywords: '{keywords_str}' (age {cache_age:.0f}s)")
+            for video in videos:
+                yield _sse('video', {'key': video.url, 'html': render_template('_video_row.html', video=video, format_duration=format_duration)})
+
+        result_id = result_store.put(videos) if videos else None
+        if videos:
+            export_jobs.submit(videos, 'xlsx', speculative=True)
+        current_app.logger.info(f"Streamed {len(videos)} videos for keywords: {keywords_str}")
+        yield _sse('done', {
+            'order': [video.url for video in videos],
+            'download_html': render_template('_download_links.html', videos=videos, result_id=result_id),
+            'top_html': render_template('_top_videos.html', videos=videos),
+        })
+    except Exception as e:
+        current_app.logger.error(f"An error occurred during streamed search for keywords '{keywords_str}': {str(e)}", exc_info=True)
+        yield _sse('search_error', {'message': "An unexpected error occurred during the search. Please try again later."})
+
+@route('/search/events')
+def search_events():
+    keywords_str = request.args.get('keywords', '')
+    try:
+        max_results = int(request.args.get('max_results', 20))
+    except ValueError:
+        max_results = 20
+    max_results = max(current_app.config['MIN_RESULTS'], min(max_results, current_app.config['MAX_RESULTS']))
+    search_mode = _search_mode(request.args.get('search_mode'))
+    ranking = _ranking(request.args.get('ranking'))
 
-@app.route('/download_excel')
+    keywords_list = [k.strip() for k in keywords_str.split(",") if k.strip()]
+    if not keywords_list:
+        return Response(_sse('search_error', {'message': "Please enter valid keywords."}), mimetype='text/event-stream')
+
+    return Response(stream_with_context(_search_event_stream(keywords_str, keywords_list, max_results, search_mode, ranking)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _stored_results():
+    # The link carries the result-set ID; fall back to the last search in this session
+    result_id = request.args.get('result_id') or session.get('result_id')
+    return result_id, result_store.get(result_id)
+
+@route('/download_excel')
 def download_excel_report():
-    global latest_videos_data
-    if not latest_videos_data:
+    result_id, videos_data = _stored_results()
+    if not videos_data:
         flash("No data available to download. Please perform a search first.", "warning")
         return redirect(url_for('index'))
 
-    temp_excel_file_path = None # Initialize to None
+    # The workbook is built by a background export job; this request never runs openpyxl
+    key = result_set_key(videos_data, 'xlsx')
+    state = export_jobs.status(key, 'xlsx')
+    if state == JOB_DONE:
+        return send_file(
+            export_jobs.path(key, 'xlsx'),
+            as_attachment=True,
+            download_name='trending_youtube_videos.xlsx',
+            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+    if state == JOB_FAILED:
+        export_jobs.discard(key) # Let the next click try again
+        flash("Error generating Excel file.", "error")
+        return redirect(url_for('index'))
+    status_code = 202
+    if state is None and export_jobs.submit(videos_data, 'xlsx', key=key) is None:
+        status_code = 503 # Too many exports queued; the page below asks again shortly
+    # Reloads this URL until the file is ready
+    response = make_response(_render('export_pending.html', export_format='Excel report',
+                                     retry_url=url_for('download_excel_report', result_id=result_id)), status_code)
+    if status_code == 503:
+        response.headers['Retry-After'] = '2'
+    return response
+
+@route('/export_status')
+def export_status():
+    # Starts the export of a stored result set if needed and reports on it, for API clients
+    export_format = request.args.get('format', 'xlsx')
+    if export_format not in ExportJobManager.FORMATS:
+        return jsonify({'error': 'Unknown export format.'}), 404
+    result_id, videos_data = _stored_results()
+    if not videos_data:
+        return jsonify({'error': 'Unknown or expired result set.'}), 404
+    key = result_set_key(videos_data, export_format)
+    state = export_jobs.status(key, export_format)
+    if state is None:
+        if export_jobs.submit(videos_data, export_format, key=key) is None:
+            return jsonify({'error': 'Too many exports queued; try again shortly.'}), 503, {'Retry-After': '2'}
+        state = export_jobs.status(key, export_format)
+    elif state == JOB_FAILED:
+        export_jobs.discard(key) # Reported once; polling again retries
+    download_url = None
+    if state == JOB_DONE:
+        download_url = (url_for('download_excel_report', result_id=result_id) if export_format == 'xlsx'
+                        else url_for('download_export', export_format=export_format, result_id=result_id))
+    return jsonify({'status': state, 'format': export_format, 'download_url': download_url})
+
+@route('/download/<export_format>')
+def download_export(export_format):
+    # CSV, NDJSON and Parquet are generated straight from the stored result set and
+    # sent as they are produced (chunked), with no temporary file
+    if export_format not in STREAMED_EXPORTS:
+        return "Unknown export format.", 404
+    _, videos_data = _stored_results()
+    if not videos_data:
+        flash("No data available to download. Please perform a search first.", "warning")
+        return redirect(url_for('index'))
+
+    iter_chunks, extension, mimetype = STREAMED_EXPORTS[export_format]
+    # A finished export job for the same results is served as a plain file instead
+    key = result_set_key(videos_data, export_format)
+    if export_jobs.status(key, export_format) == JOB_DONE:
+        return send_file(export_jobs.path(key, export_format), as_attachment=True,
+                         download_name=f'trending_youtube_videos.{extension}', mimetype=mimetype)
     try:
-        # Create a temporary file to save the Excel output
-        # delete=False is important because send_file needs to access it after this block
-        with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmpfile:
-            temp_excel_file_path = tmpfile.name
-        
-        # Call save_to_excel with the global data, temp file path, and format_duration function
-        # save_to_excel from excel_utils.py will handle the actual Excel creation
-        excel_file_path_returned = save_to_excel(latest_videos_data, temp_excel_file_path, format_duration_func=format_duration)
-
-        if excel_file_path_returned:
-            app.logger.info(f"Excel file generated at {excel_file_path_returned}, sending to user.")
-            return send_file(
-                excel_file_path_returned,
-                as_attachment=True,
-                download_name='trending_youtube_videos.xlsx',
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
-        else:
-            app.logger.error("Error generating Excel file: save_to_excel returned None.")
-            flash("Error generating Excel file.", "error")
-            return redirect(url_for('search_results')) # Or back to index, or wherever appropriate
-    except Exception as e:
-        app.logger.error(f"An error occurred during Excel download: {str(e)}", exc_info=True)
-        flash(f"An error occurred while preparing the Excel file: {str(e)}", "error")
-        return redirect(url_for('index')) # Redirect to home on error
-    finally:
-        # Clean up the temporary file from the server
-        if temp_excel_file_path and os.path.exists(temp_excel_file_path):
-            try:
-                os.remove(temp_excel_file_path)
-                app.logger.info(f"Temporary Excel file {temp_excel_file_path} deleted.")
-            except Exception as e_remove:
-                app.logger.error(f"Error deleting temporary Excel file {temp_excel_file_path}: {e_remove}")
+        chunks = iter_chunks(videos_data, format_duration_func=format_duration)
+    except RuntimeError as e:
+        current_app.logger.error(f"{export_format} export is unavailable: {e}")
+        flash(f"{export_format.upper()} export is not available on this server.", "error")
+        return redirect(url_for('index'))
+    return Response(chunks, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=trending_youtube_videos.{extension}',
+        'X-Accel-Buffering': 'no',
+    })
+
+@route('/thumb/<video_id>')
+def thumbnail(video_id):
+    # Fetched, resized and stored on first request, then served from the thumbnail
+    # store (which the Excel export reads through too); ?variant= picks a sized variant
+    variant = request.args.get('variant', 'original')
+    if variant != 'original' and variant not in THUMBNAIL_VARIANTS:
+        return "Unknown thumbnail variant.", 404
+    path = thumbnail_file(video_id, variant)
+    if path is None:
+        response = make_response("Thumbnail not available.", 404)
+        response.headers['Cache-Control'] = 'no-store' # Try upstream again next time
+        return response
+    # Stored file names carry a content hash, so the name is a strong ETag;
+    # send_file answers a matching If-None-Match with 304
+    return send_file(path, mimetype='image/gif' if path.endswith('.gif') else 'image/jpeg',
+                     etag=os.path.basename(path), max_age=THUMBNAIL_HTTP_MAX_AGE, conditional=True)
+
+@route('/metrics')
+def metrics():
+    # Prometheus text exposition format. Counts cover this process only: under
+    # gunicorn each worker keeps its own, and a scrape reports whichever worker answers it
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@route('/cache_stats')
+def cache_stats():
+    # Hit/miss/eviction counters for the video details cache, used to size it
+    return jsonify(get_cache_stats())
+
+@warm_up_hook
+def _import_heavy_libraries(app):
+    # The modules below are imported lazily on first use; in a preloading
+    # master they are imported once and shared copy-on-write by every worker
+    import numpy # noqa: F401
+    import pandas # noqa: F401
+    import openpyxl # noqa: F401
+    import PIL.Image # noqa: F401
+    import youtubesearchpython # noqa: F401
+    import yt_dlp
+    yt_dlp.extractor.gen_extractor_classes() # What every new YoutubeDL would otherwise load
+    try:
+        import pyarrow.parquet # noqa: F401
+    except ImportError:
+        pass # Only needed for snapshots and Parquet export
+
+@warm_up_hook
+def _compile_templates(app):
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def warm_up(app):
+    """Runs every warm-up hook, so the first requests do not pay for imports and compilation."""
+    for hook in _warm_up_hooks:
+        started = time.perf_counter()
+        hook(app)
+        app.logger.info(f"Warm-up {hook.__name__} took {(time.perf_counter() - started) * 1000:.0f}ms")
+
+def create_app(config=None):
+    """
+    Builds the Flask app. Settings come from config_from_env(), then from
+    config. Importing this module is cheap; the heavy libraries are imported
+    when first used, or up front by warm_up() with WARM_UP set.
+    """
+    app = Flask(__name__)
+    app.config.update(config_from_env())
+    app.config.update(config or {})
+    app.secret_key = app.config['SECRET_KEY']
+
+    # Only takes effect if nothing (e.g. the embedding server) has configured logging yet
+    logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s - %(levelname)s - %(message)s')
+
+    app.add_template_global(thumbnail_url)
+    app.before_request(_start_request_timing)
+    app.after_request(_finish_request_timing)
+    for rule, view_func, options in _routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+
+    if app.config['WARM_UP']:
+        warm_up(app)
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # `app` is built on first access, for `flask --app <package>.app` and other
+    # callers that expect a module-level app rather than the factory
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
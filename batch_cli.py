@@ -0,0 +1,425 @@
+"""
+Headless batch mode: runs search_youtube for every line of a keyword file and
+streams the results to CSV, JSONL or Parquet as each search finishes.
+
+Each line of the keyword file is one search; like the web form, a line can
+hold several comma-separated keywords. Blank lines and lines starting with
+'#' are skipped. Progress is checkpointed next to the output after every
+durable write, so re-running the same command after a crash or Ctrl-C skips
+the searches that already finished (searches that failed are retried).
+A search shed by the rate limiter or circuit breaker is put back in the
+queue and retried once the upstream's retry-after has passed.
+
+CSV and JSONL output is a single file. Parquet output is a directory of
+part files (part-00000.parquet, ...), one per --parquet-batch rows.
+
+Usage (from the directory that contains the app package):
+    python -m <package>.batch_cli keywords.txt --output trends.jsonl
+    python -m <package>.batch_cli keywords.txt --output trends.parquet --max-results 50 --workers 4
+    python -m <package>.batch_cli keywords.txt --output trends.csv --excel trends.xlsx
+"""
+import os
+import sys
+import csv
+import json
+import shutil
+import logging
+import argparse
+import threading
+import concurrent.futures
+from datetime import datetime, timezone
+
+from .youtube_utils import (search_youtube, format_duration, extract_video_id, SEARCH_MODES, SEARCH_MODE_COMBINED,
+                            RANKINGS, RANKING_RECENT)
+from .excel_utils import save_to_excel
+from .models import VideoRecord
+from .ratelimit_utils import UpstreamUnavailable
+
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RESULTS = 20
+DEFAULT_PARQUET_BATCH_ROWS = 5000
+OUTPUT_FORMATS = ('csv', 'jsonl', 'parquet')
+CHECKPOINT_VERSION = 2 # 2: dropped the thumbnail_excel column
+# A search shed by the upstream is requeued after its retry-after (at least
+# REQUEUE_MIN_DELAY seconds), up to REQUEUE_LIMIT times before it counts as failed
+REQUEUE_MIN_DELAY = 1.0
+REQUEUE_LIMIT = 20
+
+# Columns of every output format, in order
+BATCH_FIELDS = [
+    'keyword', 'rank', 'video_id', 'title', 'url', 'channel_name', 'views', 'likes', 'comments',
+    'duration_seconds', 'upload_date', 'engagement_score', 'views_per_hour', 'acceleration',
+    'thumbnail', 'collected_at',
+]
+_INT_FIELDS = ('rank', 'views', 'likes', 'comments', 'duration_seconds', 'engagement_score')
+_FLOAT_FIELDS = ('views_per_hour', 'acceleration') # Only filled in with --ranking velocity
+
+
+def read_keywords(path):
+    """Returns the searches in a keyword file, in file order, without duplicates."""
+    searches = []
+    seen = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or line in seen:
+                continue
+            seen.add(line)
+            searches.append(line)
+    return searches
+
+def _video_rows(keyword, videos, collected_at):
+    rows = []
+    for rank, video in enumerate(videos, start=1):
+        rows.append({
+            'keyword': keyword,
+            'rank': rank,
+            'video_id': extract_video_id(video.url),
+            'title': video.title,
+            'url': video.url,
+            'channel_name': video.channel_name,
+            'views': video.views,
+            'likes': video.likes,
+            'comments': video.comments,
+            'duration_seconds': video.duration_seconds,
+            'upload_date': video.upload_timestamp.strftime('%Y-%m-%d') if video.upload_timestamp else None,
+            'engagement_score': video.engagement_score,
+            'views_per_hour': video.views_per_hour,
+            'acceleration': video.acceleration,
+            'thumbnail': video.thumbnail,
+            'collected_at': collected_at,
+        })
+    return rows
+
+
+class _FileRowWriter:
+    """
+    Appends rows to a single CSV or JSONL file. flush() makes everything written
+    so far durable; position() is the file size to record in the checkpoint,
+    and a resumed run truncates back to it to drop rows written after it.
+    """
+
+    def __init__(self, path, fmt, resume_position=0):
+        self.path = path
+        self.fmt = fmt
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                f.truncate(resume_position)
+        self._file = open(path, 'a', encoding='utf-8', newline='')
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=BATCH_FIELDS)
+            if resume_position == 0:
+                self._csv.writeheader()
+
+    def write(self, rows):
+        for row in rows:
+            if self.fmt == 'csv':
+                self._csv.writerow(row)
+            else:
+                self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+    def pending_rows(self):
+        return 0 # Every write is flushed with its checkpoint
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def position(self):
+        return os.path.getsize(self.path)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetRowWriter:
+    """
+    Buffers rows and writes them out as numbered Parquet part files in a
+    directory. A part is written to a temporary name and renamed into place,
+    so a crash never leaves a half-written part behind.
+    """
+
+    def __init__(self, path, resume_position=0):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow).")
+        self._pa = pa
+        self._pq = pq
+        self.schema = pa.schema([
+            (name, pa.int64() if name in _INT_FIELDS else pa.float64() if name in _FLOAT_FIELDS else pa.string())
+            for name in BATCH_FIELDS
+        ])
+        self.path = path
+        self._parts = resume_position
+        self._buffer = []
+        os.makedirs(path, exist_ok=True)
+        # Parts beyond the checkpoint were written after it; their searches will be redone
+        for name in os.listdir(path):
+            if name.startswith('part-') and (not name.endswith('.parquet') or int(name[5:10]) >= resume_position):
+                os.remove(os.path.join(path, name))
+
+    def _part_path(self, index):
+        return os.path.join(self.path, f"part-{index:05d}.parquet")
+
+    def write(self, rows):
+        self._buffer.extend(rows)
+
+    def pending_rows(self):
+        return len(self._buffer)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        table = self._pa.Table.from_pylist(self._buffer, schema=self.schema)
+        final_path = self._part_path(self._parts)
+        tmp_path = f"{final_path}.tmp"
+        self._pq.write_table(table, tmp_path)
+        os.replace(tmp_path, final_path)
+        self._parts += 1
+        self._buffer = []
+
+    def position(self):
+        return self._parts
+
+    def close(self):
+        pass
+
+
+def _iter_output_rows(path, fmt):
+    """Reads the rows of a finished batch output back, in order."""
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        for name in sorted(os.listdir(path)):
+            if name.startswith('part-') and name.endswith('.parquet'):
+                for batch in pq.ParquetFile(os.path.join(path, name)).iter_batches():
+                    yield from batch.to_pylist()
+        return
+    with open(path, encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield {k: (int(v) if k in _INT_FIELDS and v else float(v) if k in _FLOAT_FIELDS and v else (v or None))
+                       for k, v in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _row_to_record(row):
+    upload_timestamp = datetime.strptime(row['upload_date'], '%Y-%m-%d') if row.get('upload_date') else None
+    return VideoRecord.from_dict(dict(
+        row,
+        upload_timestamp=upload_timestamp,
+        date=upload_timestamp.strftime('%d/%m/%Y') if upload_timestamp else 'N/A',
+    ))
+
+
+class Checkpoint:
+    """
+    Progress of one batch run, kept as JSON next to the output: the searches
+    that are done (with their row counts), the ones that failed, and the output
+    position (file size or part count) that matches the done searches.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.done = {}
+        self.failed = {}
+        self.position = 0
+
+    @classmethod
+    def load(cls, path, settings):
+        checkpoint = cls(path, settings)
+        if not os.path.exists(path):
+            return checkpoint
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') != CHECKPOINT_VERSION or state.get('settings') != settings:
+            raise ValueError(f"Checkpoint {path} was written with different settings "
+                             f"({state.get('settings')}); rerun with --restart to start over.")
+        checkpoint.done = state.get('done', {})
+        checkpoint.failed = state.get('failed', {})
+        checkpoint.position = state.get('position', 0)
+        return checkpoint
+
+    def save(self):
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'settings': self.settings,
+            'done': self.done,
+            'failed': self.failed,
+            'position': self.position,
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def _progress(message):
+    print(message, file=sys.stderr, flush=True)
+
+def _search(keyword, max_results, mode, ranking, delay=0.0, stop=None):
+    # A requeued search waits out the upstream's retry-after first, unless the run is stopping
+    if delay and stop is not None and stop.wait(delay):
+        raise KeyboardInterrupt
+    videos = search_youtube(keyword, max_results=max_results, mode=mode, ranking=ranking)
+    return videos, datetime.now(timezone.utc).isoformat()
+
+def run_batch(searches, output, fmt, checkpoint, max_results=DEFAULT_MAX_RESULTS, workers=DEFAULT_WORKERS,
+              mode=SEARCH_MODE_COMBINED, parquet_batch_rows=DEFAULT_PARQUET_BATCH_ROWS, ranking=RANKING_RECENT):
+    """
+    Runs every search not yet done in checkpoint with at most `workers` in
+    flight, streaming rows to output and saving the checkpoint after every
+    durable write. A search that raises is recorded as failed (and retried
+    by the next run); one shed by the upstream (UpstreamUnavailable) is
+    requeued after its retry-after instead. Returns the number of searches
+    that failed in this run.
+    """
+    if fmt == 'parquet':
+        writer = _ParquetRowWriter(output, checkpoint.position)
+    else:
+        writer = _FileRowWriter(output, fmt, checkpoint.position)
+
+    todo = [keyword for keyword in searches if keyword not in checkpoint.done]
+    _progress(f"{len(searches) - len(todo)} of {len(searches)} searches already done; running {len(todo)}.")
+    unflushed = {} # keyword -> row count, written but not yet durable
+    requeues = {} # keyword -> times requeued after being shed
+    stop = threading.Event() # Wakes requeued searches that are waiting when the run ends
+    failures = 0
+    completed = 0
+
+    def commit():
+        writer.flush()
+        checkpoint.position = writer.position()
+        checkpoint.done.update(unflushed)
+        unflushed.clear()
+        checkpoint.save()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    try:
+        # Keep a small window in flight so thousands of searches are not queued up front
+        keywords = iter(todo)
+        pending = {}
+        for keyword in keywords:
+            pending[executor.submit(_search, keyword, max_results, mode, ranking)] = keyword
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                keyword = pending.pop(future)
+                error = None
+                try:
+                    videos, collected_at = future.result()
+                except UpstreamUnavailable as e:
+                    requeues[keyword] = requeues.get(keyword, 0) + 1
+                    if requeues[keyword] <= REQUEUE_LIMIT:
+                        delay = max(e.retry_after or 0.0, REQUEUE_MIN_DELAY)
+                        _progress(f"'{keyword}' postponed ({e}); retrying in {delay:.1f}s")
+                        pending[executor.submit(_search, keyword, max_results, mode, ranking, delay, stop)] = keyword
+                        continue
+                    error = e
+                except Exception as e: # Includes SearchFailed; never recorded as done
+                    error = e
+                completed += 1
+                if error is not None:
+                    failures += 1
+                    checkpoint.failed[keyword] = str(error)
+                    _progress(f"[{completed}/{len(todo)}] '{keyword}' failed: {error}")
+                    continue
+                checkpoint.failed.pop(keyword, None)
+                rows = _video_rows(keyword, videos, collected_at)
+                writer.write(rows)
+                unflushed[keyword] = len(rows)
+                _progress(f"[{completed}/{len(todo)}] '{keyword}': {len(rows)} videos")
+                # Parquet waits for a full part before making rows durable
+                if fmt != 'parquet' or writer.pending_rows() >= parquet_batch_rows:
+                    commit()
+            for keyword in keywords:
+                pending[executor.submit(_search, keyword, max_results, mode, ranking)] = keyword
+                if len(pending) >= workers * 2:
+                    break
+        commit()
+    except KeyboardInterrupt:
+        _progress("Interrupted; saving progress. Run the same command again to resume.")
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        commit()
+        raise
+    finally:
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('keywords_file', help="Text file with one search (comma-separated keywords) per line")
+    parser.add_argument('--output', required=True, help="Output file (.csv/.jsonl) or directory (.parquet)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, help="Output format (default: from the output extension)")
+    parser.add_argument('--max-results', type=int, default=DEFAULT_MAX_RESULTS, help="Videos per search")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Searches run at once")
+    parser.add_argument('--mode', choices=SEARCH_MODES, default=SEARCH_MODE_COMBINED, help="Keyword search mode")
+    parser.add_argument('--ranking', choices=RANKINGS, default=RANKING_RECENT, help="How each search's results are ranked")
+    parser.add_argument('--checkpoint', help="Checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="Discard any checkpoint and existing output first")
+    parser.add_argument('--parquet-batch', type=int, default=DEFAULT_PARQUET_BATCH_ROWS, help="Rows per Parquet part file")
+    parser.add_argument('--excel', help="Also write every row to this Excel file once all searches are done")
+    parser.add_argument('--log-level', default='WARNING', help="Logging level (default: WARNING)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+    fmt = args.format or os.path.splitext(args.output.rstrip('/\\'))[1].lstrip('.').lower()
+    if fmt not in OUTPUT_FORMATS:
+        parser.error(f"Cannot tell the output format from '{args.output}'; use --format.")
+    if args.max_results < 1 or args.workers < 1:
+        parser.error("--max-results and --workers must be at least 1.")
+
+    checkpoint_path = args.checkpoint or f"{args.output.rstrip('/')}.checkpoint.json"
+    if args.restart:
+        for path in (checkpoint_path, args.output):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    searches = read_keywords(args.keywords_file)
+    settings = {'output': os.path.abspath(args.output), 'format': fmt,
+                'max_results': args.max_results, 'mode': args.mode, 'ranking': args.ranking}
+    try:
+        checkpoint = Checkpoint.load(checkpoint_path, settings)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        failures = run_batch(searches, args.output, fmt, checkpoint, args.max_results, args.workers,
+                             args.mode, args.parquet_batch, args.ranking)
+    except KeyboardInterrupt:
+        return 130
+
+    total_rows = sum(checkpoint.done.values())
+    print(f"{len(checkpoint.done)} of {len(searches)} searches done, {total_rows} rows in {args.output}; "
+          f"{failures} failed (rerun to retry them).")
+
+    if args.excel:
+        if failures:
+            _progress("Writing Excel from the searches that succeeded so far.")
+        videos = (_row_to_record(row) for row in _iter_output_rows(args.output, fmt))
+        if save_to_excel(videos, args.excel, format_duration_func=format_duration):
+            print(f"Excel written to {args.excel}")
+        else:
+            return 1
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,318 @@
+"""
+Offline performance benchmark for the /search -> /download_excel flow.
+
+Runs the real Flask app, search_youtube and the background Excel export job
+(which fetches the thumbnails through the thumbnail store), but swaps the
+network-facing pieces for local stand-ins:
+  - VideosSearch returns synthetic video links,
+  - yt_dlp.YoutubeDL.extract_info sleeps for a configurable latency and fails
+    at a configurable rate,
+  - thumbnails are served by a local HTTP server.
+
+Each result-set size runs in its own subprocess (so peak RSS is per size) and
+every iteration starts from empty caches, so numbers are comparable across
+commits. Results are printed (or written with --output) as JSON.
+
+Usage (from the repository root):
+    python benchmarks/bench_search.py
+    python benchmarks/bench_search.py --sizes 20 200 --iterations 5 --output bench.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import importlib
+import resource
+import platform
+import threading
+import subprocess
+import statistics
+import http.server
+from unittest import mock
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = os.path.basename(REPO_DIR)
+
+DEFAULT_SIZES = [20, 200, 2000]
+DEFAULT_ITERATIONS = 3
+DEFAULT_LATENCY = 0.05 # Seconds per fake extract_info call
+DEFAULT_JITTER = 0.02
+DEFAULT_FAILURE_RATE = 0.05
+DEFAULT_SEED = 1234
+
+
+def _import_app_modules():
+    """Imports the app as a package (it uses relative imports) and returns its modules."""
+    sys.path.insert(0, os.path.dirname(REPO_DIR))
+    return {
+        name: importlib.import_module(f"{PACKAGE_NAME}.{name}")
+        for name in ('app', 'youtube_utils', 'excel_utils', 'cache_utils', 'thumbnail_utils', 'results_utils', 'ratelimit_utils', 'snapshot_utils', 'jobs_utils')
+    }
+
+
+def _make_thumbnail_bytes():
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new('RGB', (480, 360), (200, 30, 30)).save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+class _ThumbnailHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the same JPEG for every path, with an ETag for conditional requests."""
+    body = b''
+    etag = '"bench-thumbnail"'
+
+    def do_GET(self):
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_thumbnail_server():
+    _ThumbnailHandler.body = _make_thumbnail_bytes()
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _ThumbnailHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_fake_videos_search():
+    class FakeVideosSearch:
+        """Stand-in for youtubesearchpython.VideosSearch returning synthetic links."""
+
+        def __init__(self, query, limit=20):
+            self.query = query
+            self.limit = limit
+            self.page = 0
+
+        def result(self):
+            start = self.page * self.limit
+            return {'result': [
+                {'title': f"Video {n}", 'link': f"https://www.youtube.com/watch?v=b{n:010d}"}
+                for n in range(start, start + self.limit)
+            ]}
+
+        def next(self):
+            self.page += 1
+            return True
+
+    return FakeVideosSearch
+
+
+def make_fake_youtube_dl(thumbnail_base_url, latency, jitter, failure_rate, seed):
+    import yt_dlp
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class FakeYoutubeDL:
+        """Stand-in for yt_dlp.YoutubeDL with configurable latency and failure rate."""
+
+        def __init__(self, params=None):
+            self.params = params or {}
+
+        def extract_info(self, url, download=False):
+            with rng_lock:
+                delay = max(0.0, latency + rng.uniform(-jitter, jitter))
+                fail = rng.random() < failure_rate
+            time.sleep(delay)
+            if fail:
+                raise yt_dlp.utils.DownloadError(f"Simulated failure for {url}")
+            video_id = url.split('v=')[-1]
+            n = int(video_id[1:])
+            return {
+                'title': f"Benchmark video {n}",
+                'uploader': f"Channel {n % 50}",
+                'view_count': 1000 + (n * 7919) % 100000,
+                'like_count': (n * 31) % 5000,
+                'comment_count': (n * 17) % 800,
+                'duration': 60 + n % 3600,
+                'upload_date': f"2024{1 + n % 12:02d}{1 + n % 28:02d}",
+                'thumbnail': f"{thumbnail_base_url}/vi/{video_id}/hqdefault.jpg",
+            }
+
+        def close(self):
+            pass
+
+    return FakeYoutubeDL
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def _isolate_caches(modules, work_dir):
+    """Points every cache and store at a fresh directory so each iteration starts cold."""
+    yu = modules['youtube_utils']
+    static_dir = os.path.join(work_dir, 'static')
+    thumbnails_dir = os.path.join(static_dir, 'thumbnails')
+    os.makedirs(thumbnails_dir)
+    yu._video_cache = modules['cache_utils'].VideoDetailsCache(db_path=os.path.join(work_dir, 'video_details.sqlite3'))
+    yu._thumbnail_store = modules['thumbnail_utils'].ThumbnailStore(base_dir=thumbnails_dir)
+    yu._ydl_pool = yu.YoutubeDLPool(yu.EXTRACTION_WORKERS, yu.YDL_OPTS)
+    yu._snapshot_store = modules['snapshot_utils'].SnapshotStore(base_dir=os.path.join(work_dir, 'snapshots'))
+    modules['app'].query_cache.clear()
+    for upstream in modules['ratelimit_utils'].UPSTREAMS:
+        upstream.reset() # Adaptive rates start from their initial value again
+    modules['app'].result_store = modules['results_utils'].ResultStore(spill_dir=os.path.join(work_dir, 'results'))
+    modules['app'].export_jobs = modules['jobs_utils'].ExportJobManager(
+        format_duration_func=yu.format_duration, cache_dir=os.path.join(work_dir, 'exports'))
+
+
+def run_size(size, iterations, latency, jitter, failure_rate, seed):
+    """Runs the benchmark for one result-set size in this process and returns its metrics."""
+    import logging
+    logging.disable(logging.ERROR) # Keep per-video logging (including simulated failures) out of the measurement
+
+    modules = _import_app_modules()
+    app_module = modules['app']
+    # Warm up so the first iteration does not also pay for the app's deferred imports
+    flask_app = app_module.create_app({'WARM_UP': True})
+    flask_app.config['MAX_RESULTS'] = max(flask_app.config['MAX_RESULTS'], size)
+
+    server = start_thumbnail_server()
+    thumbnail_base_url = f"http://127.0.0.1:{server.server_port}"
+
+    search_latencies = []
+    export_latencies = []
+    export_sizes = []
+    video_counts = []
+    try:
+        with mock.patch.object(modules['youtube_utils'], 'VideosSearch', make_fake_videos_search()), \
+             mock.patch('yt_dlp.YoutubeDL', make_fake_youtube_dl(thumbnail_base_url, latency, jitter, failure_rate, seed)):
+            for iteration in range(iterations):
+                work_dir = tempfile.mkdtemp(prefix='bench_search_')
+                try:
+                    _isolate_caches(modules, work_dir)
+                    client = flask_app.test_client()
+
+                    started = time.perf_counter()
+                    response = client.post('/search', data={'keywords': f"benchmark {iteration}", 'max_results': size})
+                    search_latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"/search returned HTTP {response.status_code}")
+                    video_counts.append(response.data.count(b'<tr data-key='))
+
+                    # The workbook is built by a background job started speculatively by
+                    # /search; poll until it is served, as the pending page does
+                    started = time.perf_counter()
+                    response = client.get('/download_excel')
+                    while response.status_code == 202:
+                        time.sleep(0.05)
+                        response = client.get('/download_excel')
+                    body = response.data
+                    export_latencies.append(time.perf_counter() - started)
+                    if response.status_code != 200:
+                        raise RuntimeError(f"/download_excel returned HTTP {response.status_code}")
+                    export_sizes.append(len(body))
+                finally:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_bytes = max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    return {
+        'size': size,
+        'iterations': iterations,
+        'videos_returned': video_counts,
+        'search_latency_seconds': {
+            'p50': _percentile(search_latencies, 50),
+            'p95': _percentile(search_latencies, 95),
+            'mean': statistics.mean(search_latencies),
+        },
+        'export_latency_seconds': {
+            'p50': _percentile(export_latencies, 50),
+            'p95': _percentile(export_latencies, 95),
+            'mean': statistics.mean(export_latencies),
+        },
+        'export_file_bytes': {
+            'p50': _percentile(export_sizes, 50),
+            'max': max(export_sizes),
+        },
+        'peak_rss_bytes': peak_rss_bytes,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Result-set sizes to benchmark")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help="Cold runs per size")
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY, help="Mean fake extract_info latency in seconds")
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER, help="Uniform +/- jitter on the latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=DEFAULT_FAILURE_RATE, help="Fraction of extractions that fail")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--single-size', type=int, help=argparse.SUPPRESS) # Internal: run one size in this process
+    args = parser.parse_args(argv)
+
+    if args.single_size is not None:
+        result = run_size(args.single_size, args.iterations, args.latency, args.jitter, args.failure_rate, args.seed)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for size in args.sizes:
+        # One subprocess per size so peak RSS and warm imports do not leak between sizes
+        cmd = [sys.executable, os.path.abspath(__file__), '--single-size', str(size),
+               '--iterations', str(args.iterations), '--latency', str(args.latency),
+               '--jitter', str(args.jitter), '--failure-rate', str(args.failure_rate), '--seed', str(args.seed)]
+        completed = subprocess.run(cmd, capture_output=True, text=True)
+        if completed.returncode != 0:
+            sys.stderr.write(completed.stderr)
+            return completed.returncode
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'iterations': args.iterations,
+            'latency': args.latency,
+            'jitter': args.jitter,
+            'failure_rate': args.failure_rate,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
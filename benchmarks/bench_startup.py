@@ -0,0 +1,151 @@
+"""
+Cold-start benchmark for the web app.
+
+Each run starts a fresh interpreter and measures, in order:
+  - import: importing the app module,
+  - create: building the app (create_app(), or the module-level app on trees
+    without a factory), including any warm-up hooks,
+  - first_page: serving the first GET /,
+  - first_search: serving the first POST /search, with the network-facing
+    pieces swapped for the bench_search stand-ins; deferred imports of the
+    heavy libraries are paid here,
+  - peak RSS of the run.
+
+Runs with warm-up off (the default) and on (WARM_UP=1, what the preload
+worker mode does in the master process) are reported separately. Results are
+printed (or written with --output) as JSON.
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = os.path.basename(REPO_DIR)
+
+DEFAULT_RUNS = 5
+
+
+def run_once():
+    """Measures one cold start in this (fresh) process and returns the timings."""
+    import importlib
+    import tempfile
+    from unittest import mock
+
+    sys.path.insert(0, os.path.dirname(REPO_DIR))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import_started = time.perf_counter()
+    app_module = importlib.import_module(f"{PACKAGE_NAME}.app")
+    imported = time.perf_counter()
+    create_app = getattr(app_module, 'create_app', None)
+    flask_app = create_app() if create_app else app_module.app
+    created = time.perf_counter()
+
+    import logging
+    logging.disable(logging.ERROR)
+    import bench_search
+    modules = bench_search._import_app_modules()
+    work_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    server = bench_search.start_thumbnail_server()
+    try:
+        client = flask_app.test_client()
+        started = time.perf_counter()
+        client.get('/')
+        first_page = time.perf_counter() - started
+        bench_search._isolate_caches(modules, work_dir)
+        fake_videos_search = bench_search.make_fake_videos_search()
+
+        class ImportingVideosSearch(fake_videos_search):
+            # The fake skips the network, not the import the real search pays for
+            def __init__(self, *args, **kwargs):
+                import youtubesearchpython # noqa: F401
+                super().__init__(*args, **kwargs)
+
+        # Started before patching: building the fake extractor imports yt_dlp,
+        # which is part of what the first search costs
+        started = time.perf_counter()
+        with mock.patch.object(modules['youtube_utils'], 'VideosSearch', ImportingVideosSearch), \
+             mock.patch('yt_dlp.YoutubeDL', bench_search.make_fake_youtube_dl(
+                 f"http://127.0.0.1:{server.server_port}", 0.0, 0.0, 0.0, 1)):
+            response = client.post('/search', data={'keywords': 'startup', 'max_results': 5})
+            first_search = time.perf_counter() - started
+            if response.status_code != 200:
+                raise RuntimeError(f"/search returned HTTP {response.status_code}")
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'import_seconds': imported - import_started,
+        'create_seconds': created - imported,
+        'first_page_seconds': first_page,
+        'first_search_seconds': first_search,
+        'peak_rss_bytes': max_rss if sys.platform == 'darwin' else max_rss * 1024,
+    }
+
+
+def _summarise(samples):
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help="Cold starts per configuration")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--single-run', action='store_true', help=argparse.SUPPRESS) # Internal: measure this process
+    args = parser.parse_args(argv)
+
+    if args.single_run:
+        print(json.dumps(run_once()))
+        return 0
+
+    results = {}
+    for name, warm_up in (('cold', '0'), ('warm_up', '1')):
+        samples = []
+        for _ in range(args.runs):
+            env = dict(os.environ, WARM_UP=warm_up)
+            completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--single-run'],
+                                       capture_output=True, text=True, env=env)
+            if completed.returncode != 0:
+                sys.stderr.write(completed.stderr)
+                return completed.returncode
+            samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        results[name] = _summarise(samples)
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': args.runs,
+        'median': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,440 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import concurrent.futures
+import logging
+from collections import OrderedDict
+from datetime import datetime
+
+from .models import VideoRecord
+
+BASE_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_APP_DIR, 'cache')
+
+# Video details cache defaults (all TTLs in seconds).
+# MEMORY_TTL is how long a record may live in the in-process LRU before we
+# re-read it from SQLite. VOLATILE_TTL is how long counts (views, likes,
+# comments) are considered fresh. STATIC_TTL is how long the rest of the record
+# (title, channel, duration, upload date) stays usable at all; after that the
+# SQLite row is dropped.
+VIDEO_CACHE_MAX_ENTRIES = 2000
+VIDEO_CACHE_MEMORY_TTL = 5 * 60
+VIDEO_CACHE_VOLATILE_TTL = 30 * 60
+VIDEO_CACHE_STATIC_TTL = 7 * 24 * 3600
+VIDEO_CACHE_DB_PATH = os.path.join(CACHE_DIR, 'video_details.sqlite3')
+
+
+def _json_default(value):
+    """Encodes datetime values so cached records round-trip through JSON."""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _json_object_hook(obj):
+    if '__datetime__' in obj and len(obj) == 1:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+
+class VideoDetailsCache:
+    """
+    Two-tier cache of per-video detail records keyed by canonical video ID.
+
+    Lookups go to an in-process LRU first and then to a local SQLite store.
+    A record whose counts are older than volatile_ttl is stale: with
+    stale_while_revalidate on, it is returned right away and refreshed on a
+    background thread, otherwise it is re-fetched inline (falling back to the
+    stale record if the fetch fails). Records older than static_ttl are misses.
+    """
+
+    def __init__(self, db_path=VIDEO_CACHE_DB_PATH, max_entries=VIDEO_CACHE_MAX_ENTRIES,
+                 memory_ttl=VIDEO_CACHE_MEMORY_TTL, volatile_ttl=VIDEO_CACHE_VOLATILE_TTL,
+                 static_ttl=VIDEO_CACHE_STATIC_TTL, stale_while_revalidate=True, refresh_workers=2):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.memory_ttl = memory_ttl
+        self.volatile_ttl = volatile_ttl
+        self.static_ttl = static_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict() # video_id -> (details, fetched_at, cached_at)
+        self._refreshing = set()
+        self._refresh_executor = concurrent.futures.ThreadPoolExecutor(max_workers=refresh_workers)
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'refreshes': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+        try:
+            db_dir = os.path.dirname(db_path)
+            if db_dir and not os.path.exists(db_dir):
+                os.makedirs(db_dir)
+            self._db = self._open_db()
+        except (OSError, sqlite3.Error) as e:
+            # The memory tier keeps working without the SQLite tier
+            logging.error(f"Could not open video details cache at {db_path}: {e}. Using memory tier only.")
+            self._db = None
+
+    def _open_db(self):
+        db = sqlite3.connect(self.db_path, check_same_thread=False, timeout=5)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS video_details ('
+            'video_id TEXT PRIMARY KEY, details TEXT NOT NULL, fetched_at REAL NOT NULL)'
+        )
+        db.commit()
+        self._db_pid = os.getpid()
+        return db
+
+    def _connection(self):
+        """
+        Returns this process's SQLite connection (call with _db_lock held), or
+        None without a SQLite tier. A connection inherited across fork() (e.g.
+        from a preloading master process) must not be used, so a forked worker
+        opens its own.
+        """
+        if self._db is not None and self._db_pid != os.getpid():
+            try:
+                self._db = self._open_db()
+            except sqlite3.Error as e:
+                logging.error(f"Could not reopen video details cache at {self.db_path}: {e}. Using memory tier only.")
+                self._db = None
+        return self._db
+
+    def stats(self):
+        """Returns a snapshot of the hit/miss/eviction counters and the current LRU size."""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['memory_entries'] = len(self._memory)
+        return snapshot
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _memory_get(self, video_id, now):
+        with self._lock:
+            entry = self._memory.get(video_id)
+            if entry is None:
+                return None
+            if now - entry[2] >= self.memory_ttl:
+                del self._memory[video_id]
+                self._stats['expirations'] += 1
+                return None
+            self._memory.move_to_end(video_id)
+            return entry
+
+    def _memory_put(self, video_id, details, fetched_at, now):
+        with self._lock:
+            self._memory[video_id] = (details, fetched_at, now)
+            self._memory.move_to_end(video_id)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def _disk_get(self, video_id):
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return None
+                row = db.execute(
+                    'SELECT details, fetched_at FROM video_details WHERE video_id = ?', (video_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Video details cache read failed for {video_id}: {e}")
+            return None
+        if row is None:
+            return None
+        try:
+            return VideoRecord.from_dict(json.loads(row[0], object_hook=_json_object_hook)), row[1]
+        except (ValueError, TypeError) as e:
+            logging.warning(f"Discarding unreadable cached details for {video_id}: {e}")
+            return None
+
+    def _disk_put(self, video_id, details, fetched_at):
+        if self._db is None:
+            return
+        try:
+            payload = json.dumps(details.to_dict(), default=_json_default)
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return
+                db.execute(
+                    'INSERT OR REPLACE INTO video_details (video_id, details, fetched_at) VALUES (?, ?, ?)',
+                    (video_id, payload, fetched_at)
+                )
+                db.commit()
+        except (TypeError, sqlite3.Error) as e:
+            logging.error(f"Video details cache write failed for {video_id}: {e}")
+
+    def _disk_delete(self, video_id):
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return
+                db.execute('DELETE FROM video_details WHERE video_id = ?', (video_id,))
+                db.commit()
+        except sqlite3.Error as e:
+            logging.error(f"Video details cache delete failed for {video_id}: {e}")
+
+    def put(self, video_id, details):
+        """Stores a freshly fetched record in both tiers."""
+        now = time.time()
+        self._memory_put(video_id, details.copy(), now, now)
+        self._disk_put(video_id, details, now)
+
+    def lookup(self, video_id):
+        """
+        Returns (details, fetched_at) from the fastest tier that has a usable
+        record, or None. Records past static_ttl are dropped.
+        """
+        now = time.time()
+        entry = self._memory_get(video_id, now)
+        if entry is not None:
+            self._count('memory_hits')
+            return entry[0], entry[1]
+
+        disk_entry = self._disk_get(video_id)
+        if disk_entry is None:
+            return None
+        details, fetched_at = disk_entry
+        if now - fetched_at >= self.static_ttl:
+            self._disk_delete(video_id)
+            self._count('expirations')
+            return None
+        self._count('disk_hits')
+        self._memory_put(video_id, details, fetched_at, now)
+        return details, fetched_at
+
+    def peek(self, video_id):
+        """
+        Returns the cached record for video_id without counting a hit or miss,
+        promoting it or refreshing it, or None. For read-only side uses (e.g.
+        finding a thumbnail URL) that should not skew the cache stats.
+        """
+        with self._lock:
+            entry = self._memory.get(video_id)
+        if entry is not None:
+            return entry[0]
+        disk_entry = self._disk_get(video_id)
+        if disk_entry is None or time.time() - disk_entry[1] >= self.static_ttl:
+            return None
+        return disk_entry[0]
+
+    def _refresh(self, video_id, loader):
+        try:
+            details = loader()
+            if details:
+                self.put(video_id, details)
+                self._count('refreshes')
+        except Exception as e:
+            logging.error(f"Background refresh failed for video {video_id}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(video_id)
+
+    def _schedule_refresh(self, video_id, loader):
+        with self._lock:
+            if video_id in self._refreshing:
+                return
+            self._refreshing.add(video_id)
+        self._refresh_executor.submit(self._refresh, video_id, loader)
+
+    def get(self, video_id, loader):
+        """
+        Returns a copy of the cached record for video_id, calling loader() to
+        fetch it on a miss (or inline refresh). loader returns a VideoRecord or None.
+        """
+        cached = self.lookup(video_id)
+        if cached is not None:
+            details, fetched_at = cached
+            if time.time() - fetched_at < self.volatile_ttl:
+                return details.copy()
+            self._count('stale_hits')
+            if self.stale_while_revalidate:
+                self._schedule_refresh(video_id, loader)
+                return details.copy()
+            fresh = loader()
+            if fresh:
+                self.put(video_id, fresh)
+                self._count('refreshes')
+                return fresh.copy()
+            logging.warning(f"Refresh failed for video {video_id}; serving stale cached details.")
+            return details.copy()
+
+        self._count('misses')
+        details = loader()
+        if details:
+            self.put(video_id, details)
+            return details.copy()
+        return None
+
+
+# Query-level result cache defaults for /search
+QUERY_CACHE_TTL = 120
+QUERY_CACHE_MAX_ENTRIES = 256
+# Expired results are kept this long past the TTL to serve while upstream is unavailable
+QUERY_CACHE_STALE_TTL = 6 * 3600
+
+def normalize_query_key(keywords, max_results, mode='combined', ranking='recent'):
+    """
+    Builds the cache key for a search: keywords lowercased, stripped,
+    de-duplicated and sorted, plus max_results, the search mode and the ranking.
+    """
+    normalized = sorted({k.strip().lower() for k in keywords if k and k.strip()})
+    return (tuple(normalized), int(max_results), mode, ranking)
+
+
+class _InFlight:
+    """A computation that is currently running for one query key."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.abandoned = False # The caller computing it gave up; waiters start over
+
+
+class QueryResultCache:
+    """
+    Short-lived cache of whole search results with in-flight coalescing.
+
+    get_or_compute returns (value, status, age_seconds) where status is
+    'HIT' (served from cache), 'MISS' (computed by this caller) or
+    'COALESCED' (another caller was already computing the same key and we
+    waited for its result instead of starting a duplicate pipeline).
+    Empty results are not cached so a transient upstream failure is not
+    remembered for the whole TTL. Expired results stay around for stale_ttl
+    more seconds, for peek(key, allow_stale=True) to serve while upstream is down.
+    """
+
+    def __init__(self, ttl=QUERY_CACHE_TTL, max_entries=QUERY_CACHE_MAX_ENTRIES, stale_ttl=QUERY_CACHE_STALE_TTL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (value, computed_at)
+        self._in_flight = {}
+
+    def get_or_compute(self, key, compute):
+        value, status, age = self.begin(key)
+        if status != 'MISS':
+            return value, status, age
+        in_flight = value
+        try:
+            value = compute()
+        except Exception as e:
+            self.finish(key, in_flight, error=e)
+            raise
+        self.finish(key, in_flight, value)
+        return value, 'MISS', 0.0
+
+    def begin(self, key):
+        """
+        get_or_compute for callers that produce the value themselves (e.g. while
+        streaming it out). Returns (value, status, age) for a HIT, or for a
+        COALESCED result once the caller computing it finishes (raising its
+        error if it failed). On a MISS returns (in_flight, 'MISS', 0.0); the
+        caller must then call finish(key, in_flight, ...) or abandon(key,
+        in_flight) whatever happens, or the callers waiting on it wait for ever.
+        """
+        while True:
+            now = time.time()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    value, computed_at = entry
+                    if now - computed_at < self.ttl:
+                        self._entries.move_to_end(key)
+                        return value, 'HIT', now - computed_at
+                    if now - computed_at >= self.ttl + self.stale_ttl:
+                        del self._entries[key]
+
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    in_flight = _InFlight()
+                    self._in_flight[key] = in_flight
+                    return in_flight, 'MISS', 0.0
+
+            in_flight.done.wait()
+            if in_flight.abandoned:
+                continue # Nothing to hand over; one of the waiters takes over the computation
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value, 'COALESCED', 0.0
+
+    def finish(self, key, in_flight, value=None, error=None):
+        """
+        Completes a computation started by begin(): caches value (unless it is
+        empty or there was an error) and hands it, or the error, to the callers
+        waiting on it. Calling it again for the same computation does nothing.
+        """
+        if in_flight.done.is_set():
+            return
+        in_flight.value = value
+        in_flight.error = error
+        with self._lock:
+            if self._in_flight.get(key) is in_flight:
+                del self._in_flight[key]
+            if error is None and value:
+                self._entries[key] = (value, time.time())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        in_flight.done.set()
+
+    def abandon(self, key, in_flight):
+        """
+        Ends a computation started by begin() without a result or an error (e.g.
+        its client went away mid-stream): the callers waiting on it go back to
+        begin(), and the first of them computes the value itself.
+        """
+        if in_flight.done.is_set():
+            return
+        in_flight.abandoned = True
+        with self._lock:
+            if self._in_flight.get(key) is in_flight:
+                del self._in_flight[key]
+        in_flight.done.set()
+
+    def peek(self, key, allow_stale=False):
+        """
+        Returns (value, age_seconds) for a fresh cached entry, or None. Never computes.
+        With allow_stale, entries up to stale_ttl past their TTL are returned too.
+        """
+        now = time.time()
+        max_age = self.ttl + self.stale_ttl if allow_stale else self.ttl
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[1] >= max_age:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], now - entry[1]
+
+    def put(self, key, value):
+        """Stores a value computed outside get_or_compute and begin() (empty values are ignored)."""
+        if not value:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,125 +1,117 @@
-import pandas as pd
-import openpyxl
-from openpyxl.drawing.image import Image as XLImage
-from openpyxl.utils import get_column_letter
 import os
+import time
 import logging
+import collections
+import concurrent.futures
 
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from .metrics_utils import EXPORT_BYTES, record_stage
+from .export_utils import EXPORT_COLUMNS, export_row_values
+from .youtube_utils import thumbnail_file, extract_video_id
 
-# Determine the base directory of the Flask application (flask_youtube_app)
-# __file__ in excel_utils.py is flask_youtube_app/excel_utils.py
-# os.path.dirname(__file__) is flask_youtube_app
-BASE_APP_DIR = os.path.dirname(os.path.abspath(__file__))
-STATIC_DIR = os.path.join(BASE_APP_DIR, 'static')
+# Thumbnails come from the same store as /thumb/<video_id>; ones not stored
+# yet are fetched by up to THUMBNAIL_WORKERS threads, a bounded window ahead
+# of the row being written
+THUMBNAIL_WORKERS = 10
+
+# Column headers and widths for the data columns (A-H), in sheet order; the
+# same columns as the streamed exports. The thumbnail images go in an
+# additional column after these.
+EXCEL_COLUMNS = [(header, width) for _, header, width in EXPORT_COLUMNS]
+THUMBNAIL_COLUMN = ('Thumbnail', 20) # Column I
+THUMBNAIL_ROW_HEIGHT = 55 # Approx height for image + padding
+
+def _excel_thumbnail(item):
+    # Returns the local path of the Excel-cell variant, None if it could not be fetched,
+    # or 'N/A' for a video without an ID to fetch it by
+    video_id = extract_video_id(item.url)
+    if not video_id:
+        return "N/A"
+    return thumbnail_file(video_id, 'excel', url=item.thumbnail)
+
+def _with_thumbnails(data):
+    """Yields (item, thumbnail) for each item in data, in order; see _excel_thumbnail."""
+    with concurrent.futures.ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS) as executor:
+        pending = collections.deque()
+        for item in data:
+            pending.append((item, executor.submit(_excel_thumbnail, item)))
+            if len(pending) >= THUMBNAIL_WORKERS * 4:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
 
 def save_to_excel(data, output_filename, format_duration_func):
     """
-    Saves video data to an Excel file, including thumbnails.
+    Saves video data (an iterable of VideoRecord) to an Excel file, including thumbnails.
+
+    Uses openpyxl's write-only mode: every row (and its thumbnail anchor) is
+    streamed out as it is produced, so the workbook is serialised once and
+    memory stays roughly flat however many rows there are.
     """
     if not data:
         logging.warning("No data provided to save_to_excel.")
         return None
 
-    final_export_data = []
-    for item_orig in data:
-        item = item_orig.copy() # Work with a copy
-        
-        # Ensure all expected numeric fields are present and are numbers, default to 0 if not
-        views = item.get('views', 0)
-        likes = item.get('likes', 0)
-        comments = item.get('comments', 0)
-        duration_seconds = item.get('duration_seconds')
-
-        try:
-            views = int(views) if views is not None else 0
-        except (ValueError, TypeError):
-            views = 0
-        try:
-            likes = int(likes) if likes is not None else 0
-        except (ValueError, TypeError):
-            likes = 0
-        try:
-            comments = int(comments) if comments is not None else 0
-        except (ValueError, TypeError):
-            comments = 0
-        
-        formatted_duration = "N/A"
-        if duration_seconds is not None:
-            try:
-                formatted_duration = format_duration_func(int(duration_seconds))
-            except (ValueError, TypeError):
-                logging.warning(f"Could not format duration for seconds: {duration_seconds}")
-                formatted_duration = "N/A" # Fallback if formatting fails
-        
-        excel_item = {
-            'Title': item.get('title', 'N/A'),
-            'URL': item.get('url', 'N/A'),
-            'Channel': item.get('channel_name', 'N/A'),
-            'Views': views,
-            'Duration': formatted_duration,
-            'Likes': likes,
-            'Comments': comments,
-            'Date': item.get('date', 'N/A') 
-        }
-        final_export_data.append(excel_item)
-    
-    df = pd.DataFrame(final_export_data)
-    
-    # Define the desired column order for the Excel sheet
-    # This order should match the headers you want in the Excel file.
-    # The thumbnail images will be added to an additional column, not part of this DataFrame directly.
-    desired_columns = ['Title', 'URL', 'Channel', 'Views', 'Duration', 'Likes', 'Comments', 'Date']
-    df = df[desired_columns]
+    # openpyxl and Pillow are only loaded once an export actually runs
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.drawing.image import Image as XLImage
+    from openpyxl.styles import Font
+    from openpyxl.utils import get_column_letter
+    from PIL import UnidentifiedImageError
 
+    started = time.perf_counter()
     try:
-        df.to_excel(output_filename, index=False, engine='openpyxl')
-        wb = openpyxl.load_workbook(output_filename)
-        ws = wb.active
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
 
-        # Set column widths for data columns (A-H for 'Title' through 'Date')
-        ws.column_dimensions['A'].width = 50  # Title
-        ws.column_dimensions['B'].width = 40  # URL
-        ws.column_dimensions['C'].width = 25  # Channel
-        ws.column_dimensions['D'].width = 10  # Views
-        ws.column_dimensions['E'].width = 15  # Duration
-        ws.column_dimensions['F'].width = 10  # Likes
-        ws.column_dimensions['G'].width = 10  # Comments
-        ws.column_dimensions['H'].width = 15  # Date
-        
-        # Thumbnail Image Column settings (Column I)
-        thumbnail_col_letter = 'I'
-        ws.column_dimensions[thumbnail_col_letter].width = 20 
-        ws[f'{thumbnail_col_letter}1'] = "Thumbnail" # Header for thumbnail column
+        # Column widths must be set before any rows are written in write-only mode
+        thumbnail_col_letter = get_column_letter(len(EXCEL_COLUMNS) + 1)
+        for col_idx, (_, width) in enumerate(EXCEL_COLUMNS, start=1):
+            ws.column_dimensions[get_column_letter(col_idx)].width = width
+        ws.column_dimensions[thumbnail_col_letter].width = THUMBNAIL_COLUMN[1]
 
-        for idx, video_data_item in enumerate(data, start=2): # enumerate from original data for thumbnail paths
-            thumb_relative_path = video_data_item.get('thumbnail') # This is like 'thumbnails/image.jpg'
-            
-            if thumb_relative_path and isinstance(thumb_relative_path, str) and thumb_relative_path.lower() != 'n/a':
-                thumb_full_path = os.path.join(STATIC_DIR, thumb_relative_path)
-                
-                if os.path.exists(thumb_full_path):
-                    try:
-                        img = XLImage(thumb_full_path)
-                        img.width, img.height = 120, 67.5 # Aspect ratio 16:9
-                        ws.row_dimensions[idx].height = 55 # Approx height for image + padding
-                        ws.add_image(img, f"{thumbnail_col_letter}{idx}")
-                    except UnidentifiedImageError:
-                        logging.error(f"Cannot identify image (it may be corrupted or not a supported format): {thumb_full_path}")
-                        ws[f"{thumbnail_col_letter}{idx}"] = "Error: Bad Image"
-                    except Exception as e:
-                        logging.error(f"Error adding image {thumb_full_path} to Excel: {e}")
-                        ws[f"{thumbnail_col_letter}{idx}"] = "Error: Image"
-                else:
-                    logging.warning(f"Thumbnail file not found: {thumb_full_path}")
-                    ws[f"{thumbnail_col_letter}{idx}"] = "Not Found"
+        header_font = Font(bold=True)
+        header_row = []
+        for header in [name for name, _ in EXCEL_COLUMNS] + [THUMBNAIL_COLUMN[0]]:
+            cell = WriteOnlyCell(ws, value=header)
+            cell.font = header_font
+            header_row.append(cell)
+        ws.append(header_row)
+
+        for idx, (video_data_item, thumb_full_path) in enumerate(_with_thumbnails(data), start=2):
+            row_values = export_row_values(video_data_item, format_duration_func)
+            thumb_cell_value = None
+
+            if thumb_full_path == "N/A":
+                thumb_cell_value = "N/A" # No video ID to fetch a thumbnail for
+            elif thumb_full_path:
+                try:
+                    img = XLImage(thumb_full_path)
+                    img.width, img.height = 120, 67.5 # Aspect ratio 16:9
+                    ws.row_dimensions[idx].height = THUMBNAIL_ROW_HEIGHT
+                    ws.add_image(img, f"{thumbnail_col_letter}{idx}")
+                except UnidentifiedImageError:
+                    logging.error(f"Cannot identify image (it may be corrupted or not a supported format): {thumb_full_path}")
+                    thumb_cell_value = "Error: Bad Image"
+                except Exception as e:
+                    logging.error(f"Error adding image {thumb_full_path} to Excel: {e}")
+                    thumb_cell_value = "Error: Image"
             else:
-                ws[f"{thumbnail_col_letter}{idx}"] = "N/A" # No thumbnail path provided
+                logging.warning(f"Thumbnail not available for {video_data_item.url}")
+                thumb_cell_value = "Not Found"
+
+            ws.append(row_values + [thumb_cell_value])
+            # The row has been written out; its height entry is no longer needed
+            ws.row_dimensions.pop(idx, None)
         
         wb.save(output_filename)
+        record_stage('excel_export', time.perf_counter() - started)
+        EXPORT_BYTES.observe(os.path.getsize(output_filename), format='xlsx')
         logging.info(f"Excel file '{output_filename}' created successfully with thumbnails.")
         return output_filename
     except Exception as e:
+        record_stage('excel_export', time.perf_counter() - started, success=False)
         logging.error(f"Error creating Excel file '{output_filename}': {e}", exc_info=True)
         return None
@@ -0,0 +1,174 @@
+import io
+import csv
+import json
+import time
+import logging
+
+from .metrics_utils import EXPORT_BYTES, record_stage
+
+# Columns of every tabular export (Excel, CSV, NDJSON, Parquet), in order:
+# (field key used by NDJSON and Parquet, header used by Excel and CSV, Excel column width)
+EXPORT_COLUMNS = [
+    ('title', 'Title', 50),
+    ('url', 'URL', 40),
+    ('channel_name', 'Channel', 25),
+    ('views', 'Views', 10),
+    ('duration', 'Duration', 15),
+    ('likes', 'Likes', 10),
+    ('comments', 'Comments', 10),
+    ('date', 'Date', 15),
+]
+_INT_COLUMNS = ('views', 'likes', 'comments')
+
+# Streamed exports are sent in chunks of roughly EXPORT_CHUNK_BYTES; Parquet
+# output is written (and sent) one row group of EXPORT_PARQUET_ROW_GROUP rows at a time
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_PARQUET_ROW_GROUP = 5000
+
+def export_row_values(item, format_duration_func):
+    """Builds the values of the EXPORT_COLUMNS, in order, for one VideoRecord."""
+    # Counts were validated when the record was built; only the duration needs formatting
+    formatted_duration = "N/A"
+    if item.duration_seconds is not None:
+        try:
+            formatted_duration = format_duration_func(item.duration_seconds)
+        except (ValueError, TypeError):
+            logging.warning(f"Could not format duration for seconds: {item.duration_seconds}")
+
+    return [
+        item.title,
+        item.url,
+        item.channel_name,
+        item.views,
+        formatted_duration,
+        item.likes,
+        item.comments,
+        item.date,
+    ]
+
+def _measured(fmt, chunks):
+    """
+    Passes the chunks through, recording the export as a '<fmt>_export' stage
+    and its total size. Only the time spent producing chunks counts, not the
+    time waiting for the client to take them.
+    """
+    started = time.perf_counter()
+    elapsed = 0.0
+    total_bytes = 0
+    try:
+        for chunk in chunks:
+            elapsed += time.perf_counter() - started
+            total_bytes += len(chunk)
+            yield chunk
+            started = time.perf_counter()
+    except GeneratorExit:
+        # The client went away mid-download; neither a success nor an export failure
+        raise
+    except Exception as e:
+        record_stage(f'{fmt}_export', elapsed + time.perf_counter() - started, success=False)
+        logging.error(f"Error streaming {fmt} export: {e}", exc_info=True)
+        raise
+    record_stage(f'{fmt}_export', elapsed + time.perf_counter() - started)
+    EXPORT_BYTES.observe(total_bytes, format=fmt)
+
+def iter_csv_chunks(data, format_duration_func, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Yields a CSV export (UTF-8, header row first) of the VideoRecords in data as byte chunks."""
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([header for _, header, _ in EXPORT_COLUMNS])
+        for item in data:
+            writer.writerow(export_row_values(item, format_duration_func))
+            if buffer.tell() >= chunk_bytes:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+    return _measured('csv', generate())
+
+def iter_ndjson_chunks(data, format_duration_func, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """Yields an NDJSON export (one object per video, keyed by field key) of data as byte chunks."""
+    keys = [key for key, _, _ in EXPORT_COLUMNS]
+
+    def generate():
+        lines = []
+        size = 0
+        for item in data:
+            line = json.dumps(dict(zip(keys, export_row_values(item, format_duration_func))), ensure_ascii=False) + '\n'
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_bytes:
+                yield ''.join(lines).encode('utf-8')
+                lines = []
+                size = 0
+        if lines:
+            yield ''.join(lines).encode('utf-8')
+    return _measured('ndjson', generate())
+
+
+class _ChunkSink:
+    """Write-only file object that collects what pyarrow writes until drain() hands it out."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_parquet_chunks(data, format_duration_func, row_group_rows=EXPORT_PARQUET_ROW_GROUP):
+    """
+    Yields a Parquet export of data as byte chunks, one row group at a time, so
+    neither the whole table nor a temporary file is ever held. Raises
+    RuntimeError straight away (before anything is yielded) if pyarrow is missing.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow).")
+
+    keys = [key for key, _, _ in EXPORT_COLUMNS]
+    schema = pa.schema([(key, pa.int64() if key in _INT_COLUMNS else pa.string()) for key in keys])
+
+    def row_group(rows):
+        columns = zip(*rows)
+        return pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                                    schema=schema)
+
+    def generate():
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            rows = []
+            for item in data:
+                rows.append(export_row_values(item, format_duration_func))
+                if len(rows) >= row_group_rows:
+                    writer.write_table(row_group(rows))
+                    rows = []
+                    yield sink.drain()
+            if rows:
+                writer.write_table(row_group(rows))
+        finally:
+            writer.close() # Writes the footer
+        yield sink.drain()
+    return _measured('parquet', generate())
@@ -0,0 +1,49 @@
+"""
+Gunicorn settings for the web app.
+
+Usage (from the directory that contains the app package):
+    gunicorn -c <package>/gunicorn.conf.py
+
+By default the master process builds the app once with WARM_UP=1 (importing
+the heavy libraries and compiling the templates) and then forks the workers,
+which share that memory copy-on-write and start serving immediately. Set
+PRELOAD=0 to have every worker build its own app instead (needed for
+--reload). Other settings come from the environment:
+    BIND               address to listen on (default 0.0.0.0:8000)
+    WEB_CONCURRENCY    worker processes (default 2 x CPUs + 1)
+    THREADS            threads per worker (default 4)
+    TIMEOUT            worker timeout in seconds (default 120)
+and the app settings read by app.config_from_env (SECRET_KEY, LOG_LEVEL, ...).
+
+Metrics are kept per process, so with several workers /metrics reports only
+the worker that answers the scrape; run WEB_CONCURRENCY=1 (with more THREADS)
+where complete counts matter.
+"""
+import os
+import gc
+import multiprocessing
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+pythonpath = os.path.dirname(_PACKAGE_DIR)
+wsgi_app = f"{os.path.basename(_PACKAGE_DIR)}.app:create_app()"
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Searches and SSE streams spend most of their time waiting on YouTube
+threads = int(os.environ.get('THREADS', 4))
+timeout = int(os.environ.get('TIMEOUT', 120))
+
+preload_app = os.environ.get('PRELOAD', '1').lower() in ('1', 'true', 'yes')
+if preload_app:
+    # Warm up once in the master rather than in every worker; this also gives
+    # every worker the same random SECRET_KEY when none is set
+    os.environ.setdefault('WARM_UP', '1')
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything the master built into the permanent generation, so the
+        # workers' garbage collections do not touch (and un-share) those pages
+        gc.freeze()
+
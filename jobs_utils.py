@@ -0,0 +1,291 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import itertools
+import tempfile
+import threading
+import logging
+
+from .excel_utils import save_to_excel
+from .export_utils import iter_csv_chunks, iter_ndjson_chunks, iter_parquet_chunks
+from .metrics_utils import REGISTRY
+
+BASE_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Export job defaults. Finished exports are written to EXPORT_CACHE_DIR under a
+# hash of the result set and format, so any worker process can serve them as a
+# plain file; files older than EXPORT_CACHE_MAX_AGE seconds are removed.
+# EXPORT_WORKERS exports are built at once per process, and at most
+# EXPORT_MAX_QUEUED jobs wait or run at once; submits past that are turned away.
+# Speculative jobs (started when a search finishes, before anyone asks for the
+# file) queue behind explicitly requested ones and are only accepted while
+# fewer than EXPORT_MAX_SPECULATIVE jobs are waiting or running.
+EXPORT_CACHE_DIR = os.path.join(BASE_APP_DIR, 'cache', 'exports')
+EXPORT_CACHE_MAX_AGE = 24 * 3600
+EXPORT_WORKERS = 2
+EXPORT_MAX_QUEUED = 16
+EXPORT_MAX_SPECULATIVE = 4
+# A build in progress is claimed with a '<file>.building' marker, so other
+# worker processes report it as pending rather than building it again. A
+# marker older than EXPORT_BUILD_TIMEOUT seconds was left by a dead worker.
+EXPORT_BUILD_TIMEOUT = 15 * 60
+# Bump when the export layout changes, so older cached files are not served
+EXPORT_CACHE_VERSION = 1
+
+# Job states reported by ExportJobManager.status()
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+# Queue priorities; lower runs first
+_PRIORITY_EXPLICIT = 0
+_PRIORITY_SPECULATIVE = 1
+
+EXPORT_JOBS = REGISTRY.counter(
+    'ytt_export_jobs_total', 'Export job requests by format and outcome.', labelnames=('format', 'outcome'))
+
+
+def result_set_key(videos, export_format):
+    """Hash of a result set's content and the export format; identical results share one export file."""
+    digest = hashlib.sha256(f"v{EXPORT_CACHE_VERSION}:{export_format}:".encode('utf-8'))
+    for video in videos:
+        digest.update(json.dumps(video.to_dict(), sort_keys=True, default=str).encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class ExportJobManager:
+    """
+    Builds export files on a local thread pool and caches them on disk.
+
+    submit() returns straight away with the job's key; the file is written to
+    a temporary name and renamed into place when it is complete, so a file at
+    path(key) is always a finished export. Submitting a result set whose
+    export already exists (or is already being built, by this or any other
+    process sharing cache_dir) does no new work, and once max_queued jobs are
+    waiting or running new ones are refused. Speculative submits wait behind
+    explicit ones and are dropped when the queue is busy; an explicit submit
+    for a queued speculative job moves it to the front.
+    """
+
+    # Format -> file extension; 'xlsx' is built by save_to_excel, the rest from the streamed exports
+    FORMATS = {'xlsx': 'xlsx', 'csv': 'csv', 'ndjson': 'ndjson', 'parquet': 'parquet'}
+    _CHUNK_WRITERS = {'csv': iter_csv_chunks, 'ndjson': iter_ndjson_chunks, 'parquet': iter_parquet_chunks}
+
+    def __init__(self, format_duration_func, cache_dir=EXPORT_CACHE_DIR, max_age=EXPORT_CACHE_MAX_AGE,
+                 workers=EXPORT_WORKERS, max_queued=EXPORT_MAX_QUEUED, build_timeout=EXPORT_BUILD_TIMEOUT,
+                 max_speculative=EXPORT_MAX_SPECULATIVE):
+        self.format_duration_func = format_duration_func
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.workers = workers
+        self.max_queued = max_queued
+        self.max_speculative = max_speculative
+        self.build_timeout = build_timeout
+        self._lock = threading.Lock()
+        self._jobs = {} # key -> (export_format, state); finished jobs are only kept if they failed
+        self._queued_priority = {} # key -> priority, while the job is pending
+        self._queue = None # (priority, sequence, key, videos, export_format); see _ensure_workers
+        self._workers_pid = None
+        self._sequence = itertools.count()
+
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            # Jobs still need somewhere to put their files; these are not shared between workers
+            self.cache_dir = tempfile.mkdtemp(prefix='ytt-exports-')
+            logging.error(f"Could not create export cache directory {cache_dir}: {e}. Using {self.cache_dir}.")
+
+    def path(self, key, export_format):
+        return os.path.join(self.cache_dir, f"{key}.{self.FORMATS[export_format]}")
+
+    def _is_cached(self, key, export_format):
+        try:
+            return time.time() - os.path.getmtime(self.path(key, export_format)) < self.max_age
+        except OSError:
+            return False
+
+    def _marker_path(self, key, export_format):
+        return f"{self.path(key, export_format)}.building"
+
+    def _is_building_elsewhere(self, key, export_format):
+        try:
+            return time.time() - os.path.getmtime(self._marker_path(key, export_format)) < self.build_timeout
+        except OSError:
+            return False
+
+    def _claim(self, key, export_format):
+        """Creates the build marker; returns False if another build (in any process) holds it."""
+        marker = self._marker_path(key, export_format)
+        for _ in range(2):
+            try:
+                os.close(os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return True
+            except FileExistsError:
+                if self._is_building_elsewhere(key, export_format):
+                    return False
+                try:
+                    os.remove(marker) # Left behind by a worker that died mid-build
+                except OSError:
+                    pass
+            except OSError as e:
+                logging.warning(f"Could not create export build marker {marker}: {e}")
+                return True # Build anyway; only the duplicate-work protection is lost
+        return False
+
+    def _release(self, key, export_format):
+        try:
+            os.remove(self._marker_path(key, export_format))
+        except OSError:
+            pass
+
+    def _ensure_workers(self):
+        # Started on first use in the process that uses them: threads do not survive fork()
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            self._workers_pid = os.getpid()
+            self._queue = queue.PriorityQueue()
+            for n in range(self.workers):
+                threading.Thread(target=self._work, name=f'export-{n}', daemon=True).start()
+
+    def _enqueue(self, priority, key, videos, export_format):
+        # Called with _lock held
+        self._queued_priority[key] = priority
+        self._queue.put((priority, next(self._sequence), key, videos, export_format))
+
+    def submit(self, videos, export_format, key=None, speculative=False):
+        """
+        Starts building the export of videos in export_format unless it is
+        cached or in progress; returns its key, or None if the queue is full
+        (try again later) or, for a speculative submit, busy. Pass key if the
+        caller already computed result_set_key(videos, export_format).
+        """
+        key = key or result_set_key(videos, export_format)
+        if self._is_cached(key, export_format):
+            EXPORT_JOBS.inc(format=export_format, outcome='cached')
+            return key
+        self._ensure_workers()
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job[1] in (JOB_PENDING, JOB_RUNNING):
+                if not speculative and self._queued_priority.get(key) == _PRIORITY_SPECULATIVE:
+                    # Someone is waiting for it now; the copy queued at the front runs first
+                    self._enqueue(_PRIORITY_EXPLICIT, key, list(videos), export_format)
+                    EXPORT_JOBS.inc(format=export_format, outcome='promoted')
+                else:
+                    EXPORT_JOBS.inc(format=export_format, outcome='joined')
+                return key
+            active = sum(1 for _, state in self._jobs.values() if state in (JOB_PENDING, JOB_RUNNING))
+            if active >= (self.max_speculative if speculative else self.max_queued):
+                EXPORT_JOBS.inc(format=export_format, outcome='skipped' if speculative else 'rejected')
+                return None
+            self._jobs[key] = (export_format, JOB_PENDING)
+            self._enqueue(_PRIORITY_SPECULATIVE if speculative else _PRIORITY_EXPLICIT, key, list(videos),
+                          export_format)
+        EXPORT_JOBS.inc(format=export_format, outcome='speculative' if speculative else 'started')
+        return key
+
+    def status(self, key, export_format):
+        """
+        Returns the job's state: done if the file is cached, this process's
+        job state if it has one, pending if another process is building it,
+        otherwise None.
+        """
+        if self._is_cached(key, export_format):
+            return JOB_DONE
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is not None:
+            return job[1]
+        return JOB_PENDING if self._is_building_elsewhere(key, export_format) else None
+
+    def discard(self, key):
+        """Forgets a failed job, so the next submit() tries again."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job[1] == JOB_FAILED:
+                del self._jobs[key]
+
+    def _set_state(self, key, export_format, state):
+        with self._lock:
+            if state == JOB_DONE:
+                self._jobs.pop(key, None) # The file on disk is the record from here on
+            else:
+                self._jobs[key] = (export_format, state)
+
+    def _work(self):
+        while True:
+            _, _, key, videos, export_format = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(key)
+                if job is None or job[1] != JOB_PENDING:
+                    continue # A promoted duplicate that has already run
+                self._jobs[key] = (export_format, JOB_RUNNING)
+                self._queued_priority.pop(key, None)
+            try:
+                self._run(key, videos, export_format)
+            except Exception as e:
+                logging.error(f"Export job {key} ({export_format}) crashed: {e}")
+                self._set_state(key, export_format, JOB_FAILED)
+
+    def _run(self, key, videos, export_format):
+        if not self._claim(key, export_format):
+            # Another process is building it; its marker (then its file) answers status() from here on
+            EXPORT_JOBS.inc(format=export_format, outcome='joined')
+            with self._lock:
+                self._jobs.pop(key, None)
+            return
+        try:
+            if self._is_cached(key, export_format): # Finished elsewhere since this job was queued
+                self._set_state(key, export_format, JOB_DONE)
+                return
+            self._build(key, videos, export_format)
+        finally:
+            self._release(key, export_format)
+
+    def _build(self, key, videos, export_format):
+        path = self.path(key, export_format)
+        tmp_path = None
+        try:
+            # A unique name: thread idents repeat across worker processes forked from one master
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f"{key}.", suffix='.tmp')
+            os.close(fd)
+            if export_format == 'xlsx':
+                if not save_to_excel(videos, tmp_path, format_duration_func=self.format_duration_func):
+                    raise RuntimeError("save_to_excel returned None")
+            else:
+                with open(tmp_path, 'wb') as f:
+                    for chunk in self._CHUNK_WRITERS[export_format](videos, format_duration_func=self.format_duration_func):
+                        f.write(chunk)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.error(f"Export job {key} ({export_format}) failed: {e}")
+            EXPORT_JOBS.inc(format=export_format, outcome='failed')
+            self._set_state(key, export_format, JOB_FAILED)
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        EXPORT_JOBS.inc(format=export_format, outcome='done')
+        self._set_state(key, export_format, JOB_DONE)
+        logging.info(f"Export job {key} ({export_format}) written to {path}.")
+        self._prune_cache_dir()
+
+    def _prune_cache_dir(self):
+        cutoff = time.time() - self.max_age
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        if entry.stat().st_mtime < cutoff:
+                            os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass # Pruned by another process
+        except OSError as e:
+            logging.warning(f"Error pruning export cache directory {self.cache_dir}: {e}")
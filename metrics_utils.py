@@ -0,0 +1,205 @@
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+import logging
+
+# Default histogram buckets, in seconds, for stage durations
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Buckets, in bytes, for export file sizes
+SIZE_BUCKETS = (10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs)
+    return '{' + escaped + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A monotonically increasing counter, optionally split by labels."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """A cumulative-bucket histogram, optionally split by labels."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {} # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[slot] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(float(bound))))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackGauge:
+    """A gauge whose values are read from a callback returning {label value tuple: number} at scrape time."""
+
+    def __init__(self, name, help_text, callback, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            logging.error(f"Metrics callback for {self.name} failed: {e}")
+            return lines
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DURATION_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_callback(self, name, help_text, callback, labelnames=()):
+        return self._register(CallbackGauge(name, help_text, callback, labelnames))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    'ytt_stage_duration_seconds', 'Duration of pipeline stages in seconds.', labelnames=('stage',))
+STAGE_RESULTS = REGISTRY.counter(
+    'ytt_stage_results_total', 'Pipeline stage runs by outcome.', labelnames=('stage', 'outcome'))
+THUMBNAIL_BYTES = REGISTRY.counter(
+    'ytt_thumbnail_bytes_fetched_total', 'Thumbnail bytes downloaded from upstream.')
+EXPORT_BYTES = REGISTRY.histogram(
+    'ytt_export_file_bytes', 'Size of generated export files in bytes.', labelnames=('format',), buckets=SIZE_BUCKETS)
+
+# Stage timings collected for the current request (see begin_request_timing).
+# Worker threads add to the same dict when their work is submitted with
+# contextvars.copy_context().run, so updates go through _request_timings_lock.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_request_timings_lock = threading.Lock()
+
+
+def record_stage(stage, duration, success=True):
+    """Records one run of a stage: its duration, its outcome and, if a request is being timed, its share of it."""
+    STAGE_DURATION.observe(duration, stage=stage)
+    STAGE_RESULTS.inc(stage=stage, outcome='success' if success else 'failure')
+    timings = _request_timings.get()
+    if timings is not None:
+        with _request_timings_lock:
+            timings[stage] = timings.get(stage, 0.0) + duration
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Times the with block as one run of stage. Raising counts as a failure;
+    the block can also set `outcome['success'] = False` on the yielded dict.
+    """
+    outcome = {'success': True}
+    started = time.perf_counter()
+    try:
+        yield outcome
+    except BaseException:
+        outcome['success'] = False
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - started, outcome['success'])
+
+def begin_request_timing():
+    """
+    Starts collecting a per-stage timing breakdown for the current request.
+    Stages run on worker threads count if the work was submitted with
+    contextvars.copy_context().run; their times are summed across threads.
+    """
+    _request_timings.set({})
+
+def end_request_timing():
+    """Stops collecting and returns the {stage: seconds} breakdown for the current request."""
+    timings = _request_timings.get()
+    _request_timings.set(None)
+    if timings is None:
+        return {}
+    with _request_timings_lock: # Stragglers from the request's worker threads may still be adding
+        return dict(timings)
+
+def render_metrics():
+    return REGISTRY.render()
@@ -0,0 +1,139 @@
+import heapq
+import logging
+from dataclasses import dataclass, field, fields, replace
+from datetime import datetime
+from typing import Optional
+
+# Sort key component for videos without an upload date: they rank as oldest
+_NO_UPLOAD_DATE = datetime.min
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value) if value is not None else default
+    except (ValueError, TypeError):
+        return default
+
+
+@dataclass(slots=True)
+class VideoRecord:
+    """
+    One video's details, validated once at construction.
+
+    Counts are always ints; duration_seconds is an int or None. thumbnail
+    holds the upstream thumbnail URL (served locally by /thumb/<video_id>).
+    engagement_score and sort_key are derived from the other fields in
+    __post_init__; call refresh() after changing counts or the upload timestamp.
+    """
+    title: str
+    url: str
+    channel_name: str = "N/A"
+    views: int = 0
+    likes: int = 0
+    comments: int = 0
+    duration_seconds: Optional[int] = None
+    date: str = "N/A" # dd/mm/YYYY, for display
+    upload_timestamp: Optional[datetime] = None
+    thumbnail: Optional[str] = None
+    views_per_hour: Optional[float] = None # Set by the velocity ranking
+    acceleration: Optional[float] = None
+    engagement_score: int = field(init=False, default=0)
+    sort_key: tuple = field(init=False, repr=False, compare=False, default=())
+
+    def __post_init__(self):
+        self.title = self.title if self.title is not None else "N/A"
+        self.channel_name = self.channel_name if self.channel_name is not None else "N/A"
+        self.views = _to_int(self.views)
+        self.likes = _to_int(self.likes)
+        self.comments = _to_int(self.comments)
+        self.duration_seconds = _to_int(self.duration_seconds, None)
+        self.refresh()
+
+    def refresh(self):
+        """Recomputes engagement_score and sort_key (newest first, then by engagement)."""
+        self.engagement_score = self.views + (self.likes * 2) + (self.comments * 3)
+        self.sort_key = (self.upload_timestamp or _NO_UPLOAD_DATE, self.engagement_score)
+
+    @classmethod
+    def from_info(cls, info_dict, video_url):
+        """Builds a record from a yt-dlp info dict. Returns None for an empty info dict."""
+        if not info_dict:
+            return None
+        upload_timestamp = None
+        formatted_date = "N/A"
+        upload_date = info_dict.get('upload_date') # Format YYYYMMDD
+        if upload_date:
+            try:
+                upload_timestamp = datetime.strptime(upload_date, "%Y%m%d")
+                formatted_date = upload_timestamp.strftime("%d/%m/%Y")
+            except (ValueError, TypeError) as e:
+                logging.warning(f"Could not parse upload date '{upload_date}' for {video_url}: {e}. Setting to N/A.")
+        return cls(
+            title=info_dict.get('title', "N/A"),
+            url=video_url,
+            channel_name=info_dict.get('uploader', "N/A"),
+            views=info_dict.get('view_count'),
+            likes=info_dict.get('like_count'),
+            comments=info_dict.get('comment_count'),
+            duration_seconds=info_dict.get('duration'),
+            date=formatted_date,
+            upload_timestamp=upload_timestamp,
+            thumbnail=info_dict.get('thumbnail', "N/A"),
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a record from a plain dict (e.g. a cached or exported row); unknown keys are ignored."""
+        record = cls(**{name: data[name] for name in _INIT_FIELDS if name in data})
+        if isinstance(record.upload_timestamp, str):
+            try:
+                record.upload_timestamp = datetime.fromisoformat(record.upload_timestamp)
+            except ValueError:
+                record.upload_timestamp = None
+            record.refresh()
+        return record
+
+    def to_dict(self):
+        """Returns the constructor fields as a plain dict (what from_dict accepts)."""
+        return {name: getattr(self, name) for name in _INIT_FIELDS}
+
+    def copy(self):
+        return replace(self)
+
+
+_INIT_FIELDS = tuple(f.name for f in fields(VideoRecord) if f.init)
+
+
+class TopK:
+    """
+    Keeps the k largest items seen so far by key in a bounded min-heap, so
+    pushing n items costs O(n log k) time and O(k) memory. Ties keep the item
+    pushed first.
+    """
+
+    def __init__(self, k, key):
+        self.k = k
+        self.key = key
+        self._heap = [] # (key, -sequence, item); the root is the smallest kept item
+        self._sequence = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, item):
+        """Offers an item; returns False if it did not make the top k."""
+        if self.k <= 0:
+            return False
+        entry = (self.key(item), -self._sequence, item)
+        self._sequence += 1
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] <= self._heap[0][:2]:
+            return False
+        heapq.heapreplace(self._heap, entry)
+        return True
+
+    def items(self):
+        """Returns the kept items, largest key first."""
+        return [entry[2] for entry in sorted(self._heap, key=lambda entry: entry[:2], reverse=True)]
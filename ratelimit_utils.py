@@ -0,0 +1,284 @@
+import re
+import time
+import random
+import threading
+import logging
+
+import requests
+
+from .metrics_utils import REGISTRY
+
+# Retry defaults for upstream calls. A throttled (429), failing (5xx) or
+# unreachable upstream is retried up to UPSTREAM_MAX_ATTEMPTS times in all,
+# sleeping a random ("full jitter") time of up to
+# UPSTREAM_BACKOFF_BASE * 2**attempt seconds, capped at UPSTREAM_BACKOFF_MAX,
+# between attempts. A Retry-After header, when there is one, sets the minimum.
+UPSTREAM_MAX_ATTEMPTS = 3
+UPSTREAM_BACKOFF_BASE = 0.5
+UPSTREAM_BACKOFF_MAX = 8.0
+# Longest a caller waits for a token before the call is shed
+UPSTREAM_ACQUIRE_TIMEOUT = 10.0
+
+# Circuit breaker defaults: after CIRCUIT_FAILURE_THRESHOLD failed calls in a
+# row the circuit opens and calls fail fast for CIRCUIT_RESET_TIMEOUT seconds,
+# then a single probe call decides whether it closes again.
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+# Token bucket rates (calls per second) per upstream: (initial, minimum, maximum, burst)
+SEARCH_RATE = (2.0, 0.2, 10.0, 5)
+# Fan-out searches (one per keyword) draw on their own budget, sized so a whole
+# fan-out with a second page per keyword fits in the burst; they share the
+# search circuit breaker, as it is the same upstream
+FANOUT_SEARCH_RATE = (8.0, 0.5, 40.0, 16)
+YTDLP_RATE = (32.0, 0.5, 200.0, 32)
+THUMBNAIL_RATE = (50.0, 1.0, 400.0, 50)
+
+_HTTP_STATUS_RE = re.compile(r'HTTP Error (\d{3})')
+
+UPSTREAM_CALLS = REGISTRY.counter(
+    'ytt_upstream_calls_total', 'Upstream call attempts by outcome.', labelnames=('upstream', 'outcome'))
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream that is rate limited past our patience or known to be down."""
+
+    def __init__(self, upstream, reason, retry_after=None):
+        super().__init__(f"Upstream '{upstream}' unavailable: {reason}")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def upstream_status(exc):
+    """Best-effort HTTP status code behind an upstream exception, or None."""
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', None)
+    if isinstance(status, int):
+        return status
+    # yt-dlp (and some search errors) only carry the status in the message
+    match = _HTTP_STATUS_RE.search(str(exc))
+    return int(match.group(1)) if match else None
+
+def is_retryable(exc):
+    """True for errors that mean the upstream is throttling, failing or unreachable, not that the request was bad."""
+    status = upstream_status(exc)
+    if status is not None:
+        return status == 429 or 500 <= status < 600
+    return isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                            ConnectionError, TimeoutError))
+
+def _retry_after(exc):
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket whose rate adapts to the upstream (AIMD).
+
+    Successes raise the rate: by one call/s per success until the first
+    throttle (slow start, so the rate roughly doubles every second under full
+    load), then by 1/rate per success (about one call/s per second).
+    A throttle multiplies the rate by decrease_factor, at most once per
+    decrease_interval so a burst of 429s from calls already in flight only
+    counts once.
+    """
+
+    def __init__(self, rate, min_rate, max_rate, burst, decrease_factor=0.5, decrease_interval=1.0):
+        self.initial_rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rate = self.initial_rate
+            self._tokens = float(self.burst)
+            self._updated_at = time.monotonic()
+            self._slow_start = True
+            self._last_decrease = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self, timeout=None):
+        """Takes one token, sleeping until one is available. Returns False if that would take longer than timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = min(self.max_rate, self.rate + (1.0 if self._slow_start else 1.0 / self.rate))
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._slow_start = False
+            if now - self._last_decrease >= self.decrease_interval:
+                self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+                self._last_decrease = now
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after failure_threshold consecutive failures; open -> half-open
+    once reset_timeout has passed, letting one probe call through; the probe's
+    outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._opened_at = 0.0
+            self._probing = False
+
+    def allow(self):
+        """Returns (allowed, seconds until the next probe when not allowed)."""
+        with self._lock:
+            if self.state == 'closed':
+                return True, None
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True, None
+            return False, max(remaining, 0.0)
+
+    def release_probe(self):
+        """Gives back the half-open probe slot taken by allow() without reporting an outcome."""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logging.info("Upstream recovered; closing circuit.")
+            self.state = 'closed'
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    logging.warning(f"Opening circuit after {self._failures} consecutive upstream failures.")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+class Upstream:
+    """
+    Guards calls to one upstream service with an AdaptiveTokenBucket, retries
+    with jittered exponential backoff and a CircuitBreaker. Errors that are not
+    retryable (a missing video, a 404) pass straight through and do not count
+    against the upstream's health.
+    """
+
+    def __init__(self, name, rate, min_rate, max_rate, burst, max_attempts=UPSTREAM_MAX_ATTEMPTS,
+                 backoff_base=UPSTREAM_BACKOFF_BASE, backoff_max=UPSTREAM_BACKOFF_MAX,
+                 acquire_timeout=UPSTREAM_ACQUIRE_TIMEOUT, breaker=None):
+        self.name = name
+        self.bucket = AdaptiveTokenBucket(rate, min_rate, max_rate, burst)
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.acquire_timeout = acquire_timeout
+
+    def reset(self):
+        self.bucket.reset()
+        self.breaker.reset()
+
+    def is_healthy(self):
+        return self.breaker.state == 'closed'
+
+    def _backoff(self, attempt, exc):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = _retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) under the rate limit, retrying retryable errors.
+        Raises UpstreamUnavailable when the circuit is open or no token comes
+        within acquire_timeout; otherwise returns func's result or raises its last error.
+        """
+        for attempt in range(self.max_attempts):
+            allowed, retry_after = self.breaker.allow()
+            if not allowed:
+                UPSTREAM_CALLS.inc(upstream=self.name, outcome='circuit_open')
+                raise UpstreamUnavailable(self.name, "circuit open", retry_after)
+            if not self.bucket.acquire(self.acquire_timeout):
+                self.breaker.release_probe()
+                UPSTREAM_CALLS.inc(upstream=self.name, outcome='shed')
+                raise UpstreamUnavailable(self.name, "rate limit wait exceeded", self.acquire_timeout)
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success() # The upstream answered; the request itself was bad
+                    UPSTREAM_CALLS.inc(upstream=self.name, outcome='error')
+                    raise
+                self.bucket.on_throttle()
+                self.breaker.record_failure()
+                if attempt + 1 >= self.max_attempts:
+                    UPSTREAM_CALLS.inc(upstream=self.name, outcome='failure')
+                    raise
+                UPSTREAM_CALLS.inc(upstream=self.name, outcome='retry')
+                delay = self._backoff(attempt, e)
+                logging.warning(f"Upstream '{self.name}' error ({e}); retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self.bucket.on_success()
+            self.breaker.record_success()
+            UPSTREAM_CALLS.inc(upstream=self.name, outcome='success')
+            return result
+
+
+search_upstream = Upstream('search', *SEARCH_RATE)
+fanout_search_upstream = Upstream('search_fanout', *FANOUT_SEARCH_RATE, breaker=search_upstream.breaker)
+ytdlp_upstream = Upstream('ytdlp', *YTDLP_RATE)
+thumbnail_upstream = Upstream('thumbnail', *THUMBNAIL_RATE)
+UPSTREAMS = (search_upstream, fanout_search_upstream, ytdlp_upstream, thumbnail_upstream)
+
+REGISTRY.gauge_callback(
+    'ytt_upstream_rate_limit', 'Current adaptive rate limit per upstream, in calls per second.',
+    lambda: {(upstream.name,): round(upstream.bucket.rate, 3) for upstream in UPSTREAMS}, labelnames=('upstream',))
+REGISTRY.gauge_callback(
+    'ytt_upstream_circuit_open', 'Whether the circuit breaker for an upstream is open (1) or closed (0).',
+    lambda: {(upstream.name,): int(not upstream.is_healthy()) for upstream in UPSTREAMS}, labelnames=('upstream',))
@@ -0,0 +1,116 @@
+import os
+import re
+import time
+import uuid
+import pickle
+import threading
+import logging
+from collections import OrderedDict
+
+BASE_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Result store defaults. The memory tier holds at most RESULT_STORE_MAX_BYTES of
+# pickled result sets per process. Result sets are also written to
+# RESULT_STORE_SPILL_DIR so any worker process can serve them, and spilled files
+# older than RESULT_STORE_MAX_AGE seconds are removed.
+RESULT_STORE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_STORE_SPILL_DIR = os.path.join(BASE_APP_DIR, 'cache', 'results')
+RESULT_STORE_MAX_AGE = 24 * 3600
+
+_RESULT_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class ResultStore:
+    """
+    Server-side store of search result sets keyed by a random result-set ID.
+
+    Result sets are kept pickled in an in-process LRU capped at max_bytes.
+    With a spill_dir, every result set is also written there, so a request
+    that lands on another worker (or comes in after the LRU evicted the set)
+    still finds it.
+    """
+
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES, spill_dir=RESULT_STORE_SPILL_DIR,
+                 max_age=RESULT_STORE_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # result_id -> pickled bytes
+        self._size = 0
+
+        if spill_dir and not os.path.exists(spill_dir):
+            try:
+                os.makedirs(spill_dir)
+            except OSError as e:
+                logging.error(f"Could not create result spill directory {spill_dir}: {e}. Keeping results in memory only.")
+                self.spill_dir = None
+
+    def _spill_path(self, result_id):
+        return os.path.join(self.spill_dir, f"{result_id}.pickle")
+
+    def _memory_put(self, result_id, payload):
+        with self._lock:
+            if result_id in self._entries:
+                self._size -= len(self._entries.pop(result_id))
+            self._entries[result_id] = payload
+            self._size += len(payload)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _prune_spill_dir(self):
+        cutoff = time.time() - self.max_age
+        try:
+            with os.scandir(self.spill_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.pickle') and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+        except OSError as e:
+            logging.warning(f"Error pruning result spill directory {self.spill_dir}: {e}")
+
+    def put(self, videos):
+        """Stores a result set and returns its new result-set ID."""
+        result_id = uuid.uuid4().hex
+        payload = pickle.dumps(videos, protocol=pickle.HIGHEST_PROTOCOL)
+        self._memory_put(result_id, payload)
+
+        if self.spill_dir:
+            tmp_path = f"{self._spill_path(result_id)}.tmp"
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self._spill_path(result_id))
+            except OSError as e:
+                logging.error(f"Could not spill result set {result_id} to disk: {e}")
+            self._prune_spill_dir()
+        return result_id
+
+    def get(self, result_id):
+        """Returns the result set stored under result_id, or None if it is unknown or expired."""
+        if not result_id or not _RESULT_ID_RE.match(result_id):
+            return None
+
+        with self._lock:
+            payload = self._entries.get(result_id)
+            if payload is not None:
+                self._entries.move_to_end(result_id)
+
+        if payload is None and self.spill_dir:
+            path = self._spill_path(result_id)
+            try:
+                if time.time() - os.path.getmtime(path) < self.max_age:
+                    with open(path, 'rb') as f:
+                        payload = f.read()
+                    self._memory_put(result_id, payload)
+            except OSError:
+                payload = None
+
+        if payload is None:
+            return None
+        try:
+            return pickle.loads(payload)
+        except (pickle.UnpicklingError, EOFError, ValueError, AttributeError, TypeError) as e:
+            # AttributeError/TypeError: pickled by a version whose record classes have since changed
+            logging.error(f"Could not load result set {result_id}: {e}")
+            return None
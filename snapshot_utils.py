@@ -0,0 +1,313 @@
+import os
+import time
+import uuid
+import atexit
+import threading
+import logging
+from collections import OrderedDict
+
+# numpy, pandas and pyarrow are imported on first use, keeping them out of app startup
+
+BASE_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Snapshot store defaults. Every fresh fetch of a video's counts is appended
+# as a (video_id, captured_at, views, likes, comments) row. Rows are buffered
+# and written out as a new Parquet part file every SNAPSHOT_FLUSH_ROWS rows or
+# SNAPSHOT_FLUSH_INTERVAL seconds; once there are more than
+# SNAPSHOT_COMPACT_PARTS parts they are merged into one file sorted by
+# video_id (so reads for a few videos skip most row groups) and rows older
+# than SNAPSHOT_RETENTION seconds are dropped.
+SNAPSHOT_DIR = os.path.join(BASE_APP_DIR, 'cache', 'snapshots')
+SNAPSHOT_FLUSH_ROWS = 1000
+SNAPSHOT_FLUSH_INTERVAL = 60
+SNAPSHOT_COMPACT_PARTS = 20
+SNAPSHOT_RETENTION = 30 * 24 * 3600
+SNAPSHOT_ROW_GROUP_SIZE = 64 * 1024
+# A video is snapshotted at most once per SNAPSHOT_MIN_INTERVAL seconds, so
+# back-to-back fetches do not produce near-zero time deltas
+SNAPSHOT_MIN_INTERVAL = 300
+SNAPSHOT_RECENT_IDS = 100_000
+# Rows kept for a later flush when writing a part fails; the oldest go first past this
+SNAPSHOT_MAX_BUFFERED_ROWS = 100_000
+
+# Trend metrics only look at snapshots from the last TREND_WINDOW seconds
+TREND_WINDOW = 7 * 24 * 3600
+
+_COLUMNS = ['video_id', 'captured_at', 'views', 'likes', 'comments']
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("The snapshot store needs pyarrow (pip install pyarrow).")
+    return pa, ds, pq
+
+
+class SnapshotStore:
+    """
+    Append-only store of per-video count snapshots in Parquet part files.
+
+    record() only buffers in memory; parts are written by flush() (on a
+    background thread once the buffer is due by size or age, and at exit) and
+    merged by compact() on a background thread, so callers never wait on or
+    see a Parquet write. Reads see both the files and the unflushed buffer.
+    Several processes can append to the same directory (part names are
+    unique); duplicate rows from overlapping compactions are dropped on read.
+    """
+
+    def __init__(self, base_dir=SNAPSHOT_DIR, flush_rows=SNAPSHOT_FLUSH_ROWS, flush_interval=SNAPSHOT_FLUSH_INTERVAL,
+                 compact_parts=SNAPSHOT_COMPACT_PARTS, retention=SNAPSHOT_RETENTION,
+                 min_interval=SNAPSHOT_MIN_INTERVAL):
+        self.base_dir = base_dir
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.compact_parts = compact_parts
+        self.retention = retention
+        self.min_interval = min_interval
+
+        self._lock = threading.Lock()
+        self._buffer = [] # Rows as tuples in _COLUMNS order
+        self._buffer_started = None
+        self._last_captured = OrderedDict() # video_id -> captured_at, bounded LRU
+        self._flushing = False
+        self._retry_flush_at = 0.0 # After a failed flush, automatic flushes wait until then
+        self._compacting = False
+        self._file_lock = threading.Lock() # Serialises part writes and compaction in this process
+
+        try:
+            os.makedirs(base_dir, exist_ok=True)
+        except OSError as e:
+            logging.error(f"Could not create snapshot directory {base_dir}: {e}. Snapshots will not be stored.")
+            self.base_dir = None
+        atexit.register(self.flush)
+
+    def _part_files(self):
+        try:
+            return sorted(
+                os.path.join(self.base_dir, name) for name in os.listdir(self.base_dir)
+                if name.endswith('.parquet')
+            )
+        except OSError:
+            return []
+
+    def record(self, video_id, views, likes, comments, captured_at=None):
+        """Buffers one snapshot of a video's counts (skipped if the video was snapshotted very recently)."""
+        if not video_id or self.base_dir is None:
+            return
+        captured_at = int(captured_at if captured_at is not None else time.time())
+        with self._lock:
+            last = self._last_captured.get(video_id)
+            if last is not None and captured_at - last < self.min_interval:
+                return
+            self._last_captured[video_id] = captured_at
+            self._last_captured.move_to_end(video_id)
+            while len(self._last_captured) > SNAPSHOT_RECENT_IDS:
+                self._last_captured.popitem(last=False)
+            self._buffer.append((video_id, captured_at, int(views or 0), int(likes or 0), int(comments or 0)))
+            if self._buffer_started is None:
+                self._buffer_started = time.time()
+            due = ((len(self._buffer) >= self.flush_rows
+                    or time.time() - self._buffer_started >= self.flush_interval)
+                   and time.time() >= self._retry_flush_at)
+            if due and self._flushing:
+                due = False # The running flush picks these rows up on its next pass
+            elif due:
+                self._flushing = True
+        if due:
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def _buffer_frame(self):
+        import pandas as pd
+        with self._lock:
+            rows = list(self._buffer)
+        return pd.DataFrame.from_records(rows, columns=_COLUMNS)
+
+    def flush(self):
+        """
+        Writes the buffered snapshots out as a new part file. Never raises: if
+        the write fails the rows go back in the buffer for the next flush.
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            buffer_started, self._buffer_started = self._buffer_started, None
+        if not rows or self.base_dir is None:
+            return
+        path = os.path.join(self.base_dir, f"part-{int(time.time() * 1000):014d}-{uuid.uuid4().hex[:8]}.parquet")
+        try:
+            pa, _, pq = _pyarrow()
+            columns = list(zip(*rows))
+            table = pa.table({name: column for name, column in zip(_COLUMNS, columns)}, schema=self._schema())
+            with self._file_lock:
+                pq.write_table(table, f"{path}.tmp")
+                os.replace(f"{path}.tmp", path)
+        except Exception as e: # Includes a missing pyarrow (RuntimeError) and Arrow errors
+            logging.error(f"Could not write snapshot part {path}: {e}")
+            self._restore(rows, buffer_started)
+            return
+        if len(self._part_files()) > self.compact_parts:
+            self._schedule_compaction()
+
+    def _restore(self, rows, buffer_started):
+        # Puts rows from a failed flush back in front of anything recorded since
+        with self._lock:
+            self._retry_flush_at = time.time() + self.flush_interval
+            self._buffer[:0] = rows
+            dropped = len(self._buffer) - SNAPSHOT_MAX_BUFFERED_ROWS
+            if dropped > 0:
+                del self._buffer[:dropped]
+                logging.warning(f"Dropped {dropped} unwritten snapshot rows; the buffer is full.")
+            if buffer_started is not None:
+                self._buffer_started = buffer_started
+            elif self._buffer and self._buffer_started is None:
+                self._buffer_started = time.time()
+
+    def _schema(self):
+        pa, _, _ = _pyarrow()
+        return pa.schema([
+            ('video_id', pa.string()),
+            ('captured_at', pa.int64()),
+            ('views', pa.int64()),
+            ('likes', pa.int64()),
+            ('comments', pa.int64()),
+        ])
+
+    def _schedule_compaction(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logging.error(f"Snapshot compaction failed: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """
+        Merges every part into one file sorted by (video_id, captured_at),
+        dropping duplicate rows and rows past the retention period.
+        """
+        if self.base_dir is None:
+            return
+        _, ds, pq = _pyarrow()
+        with self._file_lock:
+            parts = self._part_files()
+            if len(parts) < 2:
+                return
+            cutoff = int(time.time() - self.retention)
+            table = ds.dataset(parts, format='parquet', schema=self._schema()).to_table(
+                filter=ds.field('captured_at') >= cutoff)
+            table = table.group_by(_COLUMNS).aggregate([]) # Drops exact duplicate rows
+            table = table.sort_by([('video_id', 'ascending'), ('captured_at', 'ascending')])
+            path = os.path.join(self.base_dir, f"compacted-{int(time.time() * 1000):014d}-{uuid.uuid4().hex[:8]}.parquet")
+            pq.write_table(table, f"{path}.tmp", row_group_size=SNAPSHOT_ROW_GROUP_SIZE)
+            os.replace(f"{path}.tmp", path)
+            for part in parts:
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass # Another process compacted it already
+        logging.info(f"Compacted {len(parts)} snapshot parts into {path} ({table.num_rows} rows).")
+
+    def load(self, video_ids=None, since=None):
+        """
+        Returns the snapshots (optionally only for video_ids and/or captured at
+        or after since) as a DataFrame with the _COLUMNS columns.
+        """
+        import pandas as pd
+
+        frames = [self._buffer_frame()]
+        if self.base_dir is not None:
+            _, ds, _ = _pyarrow()
+            condition = None
+            if video_ids is not None:
+                condition = ds.field('video_id').isin(list(video_ids))
+            if since is not None:
+                since_condition = ds.field('captured_at') >= int(since)
+                condition = since_condition if condition is None else condition & since_condition
+            for attempt in range(2):
+                parts = self._part_files()
+                if not parts:
+                    break
+                try:
+                    frames.append(ds.dataset(parts, format='parquet', schema=self._schema())
+                                  .to_table(filter=condition).to_pandas())
+                    break
+                except (OSError, FileNotFoundError):
+                    if attempt: # A compaction removed parts while we read; the retry sees the merged file
+                        raise
+        df = pd.concat(frames, ignore_index=True)
+        if video_ids is not None:
+            df = df[df['video_id'].isin(list(video_ids))]
+        if since is not None:
+            df = df[df['captured_at'] >= int(since)]
+        return df.drop_duplicates(subset=['video_id', 'captured_at'])
+
+    def trend_metrics(self, video_ids=None, now=None, window=TREND_WINDOW):
+        """Loads the recent snapshots and returns compute_trend_metrics() for them."""
+        now = time.time() if now is None else now
+        return compute_trend_metrics(self.load(video_ids, since=now - window))
+
+
+def compute_trend_metrics(snapshots):
+    """
+    Computes each video's latest views-per-hour and acceleration (change in
+    views-per-hour per hour) from consecutive snapshots, vectorised over the
+    whole frame. Returns a DataFrame indexed by video_id with views,
+    views_per_hour, acceleration, snapshots and last_captured_at. Videos with
+    a single snapshot get NaN velocity and acceleration.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if snapshots.empty:
+        return pd.DataFrame(columns=['views', 'views_per_hour', 'acceleration', 'snapshots', 'last_captured_at'],
+                            index=pd.Index([], name='video_id'))
+    df = snapshots.sort_values(['video_id', 'captured_at'], kind='stable')
+    video_ids = df['video_id'].to_numpy()
+    hours = df['captured_at'].to_numpy(dtype=np.float64) / 3600.0
+    views = df['views'].to_numpy(dtype=np.float64)
+
+    # Rows whose previous row belongs to the same video
+    same_video = np.zeros(len(df), dtype=bool)
+    same_video[1:] = video_ids[1:] == video_ids[:-1]
+
+    dt = np.full(len(df), np.nan)
+    dt[1:] = hours[1:] - hours[:-1]
+    dt[~same_video | (dt <= 0)] = np.nan
+    velocity = np.full(len(df), np.nan)
+    velocity[1:] = (views[1:] - views[:-1])
+    velocity /= dt
+
+    # Acceleration between consecutive velocities, over the time between their midpoints
+    same_velocity = np.zeros(len(df), dtype=bool)
+    same_velocity[1:] = same_video[1:] & same_video[:-1]
+    acceleration = np.full(len(df), np.nan)
+    acceleration[1:] = (velocity[1:] - velocity[:-1]) / ((dt[1:] + dt[:-1]) / 2.0)
+    acceleration[~same_velocity] = np.nan
+
+    df = df.assign(views_per_hour=velocity, acceleration=acceleration)
+    grouped = df.groupby('video_id', sort=False)
+    latest = grouped.tail(1).set_index('video_id')
+    return pd.DataFrame({
+        'views': latest['views'],
+        'views_per_hour': latest['views_per_hour'],
+        'acceleration': latest['acceleration'],
+        'snapshots': grouped.size(),
+        'last_captured_at': latest['captured_at'],
+    })
@@ -0,0 +1,429 @@
+import os
+import io
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+# Pillow is imported by the functions that decode images, on first use
+
+from .metrics_utils import THUMBNAIL_BYTES, record_stage
+from .ratelimit_utils import UpstreamUnavailable, thumbnail_upstream
+
+BASE_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+THUMBNAILS_DIR = os.path.join(BASE_APP_DIR, 'static', 'thumbnails')
+
+# Thumbnail store limits. Files are evicted oldest-first once the store grows
+# past THUMBNAIL_STORE_MAX_BYTES or a file is older than THUMBNAIL_STORE_MAX_AGE.
+# A stored thumbnail younger than THUMBNAIL_REVALIDATE_AFTER is served without
+# contacting the server; after that we revalidate with a conditional request.
+THUMBNAIL_STORE_MAX_BYTES = 200 * 1024 * 1024
+THUMBNAIL_STORE_MAX_AGE = 7 * 24 * 3600
+THUMBNAIL_REVALIDATE_AFTER = 24 * 3600
+THUMBNAIL_FETCH_TIMEOUT = 10
+# Files in the store that no index entry refers to (e.g. left by a crash
+# between writing a file and indexing it) are removed once they are older than
+# THUMBNAIL_ORPHAN_GRACE; the directory is checked at most once per
+# THUMBNAIL_ORPHAN_SWEEP_INTERVAL (seconds) per process.
+THUMBNAIL_ORPHAN_GRACE = 10 * 60
+THUMBNAIL_ORPHAN_SWEEP_INTERVAL = 3600
+# Browsers may reuse a thumbnail served by /thumb/<video_id> for this long
+# (seconds) before revalidating it with If-None-Match
+THUMBNAIL_HTTP_MAX_AGE = 7 * 24 * 3600
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+
+# Pre-shrunk variants generated once per stored thumbnail, as (width, height) bounds.
+# 'excel' matches the 120x67.5 cell image in save_to_excel; 'grid' covers the
+# results table and the top-3 cards (max 200px wide) on high-DPI screens.
+THUMBNAIL_VARIANTS = {
+    'excel': (120, 68),
+    'grid': (240, 135),
+}
+
+
+def _create_http_session(pool_size=16):
+    """Creates a keep-alive requests.Session with a connection pool sized for our thread pools."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Shared session for every thumbnail fetch so connections to the image host are reused
+http_session = _create_http_session()
+
+
+def fetch_image_bytes(url, headers=None, session=None, timeout=THUMBNAIL_FETCH_TIMEOUT):
+    """
+    Downloads an image with a single streamed GET, through the thumbnail
+    upstream's rate limiter (429/5xx responses are retried with backoff).
+    Returns the requests.Response with its body already read into response.content.
+    Raises requests.exceptions.RequestException on HTTP or network errors and
+    UpstreamUnavailable when the request was shed.
+    """
+    session = session or http_session
+
+    def get():
+        response = session.get(url, headers=headers or {}, timeout=timeout, stream=True)
+        try:
+            if response.status_code != 304:
+                response.raise_for_status()
+            # Accessing .content drains the stream once; nothing is downloaded twice
+            THUMBNAIL_BYTES.inc(len(response.content))
+        finally:
+            response.close()
+        return response
+
+    started = time.perf_counter()
+    success = False
+    try:
+        response = thumbnail_upstream.call(get)
+        success = True
+        return response
+    finally:
+        record_stage('thumbnail_fetch', time.perf_counter() - started, success)
+
+
+def write_image(content, save_path):
+    """
+    Writes downloaded image bytes to save_path.
+    JPEG input is written as-is; anything else is decoded and re-encoded
+    (GIF stays GIF, everything else becomes JPEG).
+    Returns the image format that was written.
+    """
+    if content[:3] == JPEG_MAGIC:
+        with open(save_path, 'wb') as f:
+            f.write(content)
+        return 'jpeg'
+
+    from PIL import Image
+    img = Image.open(io.BytesIO(content))
+    if img.format and img.format.lower() not in ['jpeg', 'png', 'gif', 'webp']:
+        logging.warning(f"Image for {save_path} is not in a standard web format (JPEG, PNG, GIF, WEBP): format is {img.format}")
+    if img.format and img.format.lower() == 'gif': # Keep GIFs (and their animation) as they are
+        img.save(save_path, "GIF")
+        return 'gif'
+    img.convert("RGB").save(save_path, "JPEG")
+    return 'jpeg'
+
+
+def variant_filename(filename, variant):
+    """Returns the file name of a sized variant, e.g. 'abc_123.jpg' -> 'abc_123_grid.jpg'."""
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}_{variant}.jpg"
+
+def make_variants(source_path, variants=None):
+    """
+    Writes every sized variant of source_path next to it and returns {variant: filename}.
+    JPEG sources are decoded with draft() at a reduced DCT scale and shrunk with
+    reduce() before the final resample, so the full-size image is never decoded.
+    """
+    from PIL import Image
+
+    variants = variants or THUMBNAIL_VARIANTS
+    base_dir = os.path.dirname(source_path)
+    filenames = {}
+    for variant, size in variants.items():
+        filename = variant_filename(os.path.basename(source_path), variant)
+        with Image.open(source_path) as img:
+            img.draft('RGB', size) # No-op for non-JPEG sources
+            img = img.convert('RGB')
+            img.thumbnail(size, reducing_gap=2.0)
+            img.save(os.path.join(base_dir, filename), 'JPEG', quality=85, optimize=True)
+        filenames[variant] = filename
+    return filenames
+
+def variant_paths(relative_path, variants=None):
+    """Returns {variant: static-relative path} for an original thumbnail path."""
+    variants = variants or THUMBNAIL_VARIANTS
+    base_dir, filename = os.path.split(relative_path)
+    return {variant: os.path.join(base_dir, variant_filename(filename, variant)) for variant in variants}
+
+# Per-video index fields, in the column order of the thumbnails table
+_INDEX_FIELDS = ('filename', 'url', 'etag', 'last_modified', 'fetched_at', 'size')
+
+
+class ThumbnailStore:
+    """
+    Content-addressed thumbnail store under static/thumbnails.
+
+    Files are named <video_id>_<content hash>.jpg, so a video keeps the same
+    file however its rank changes, and a changed image gets a new name (which
+    also busts browser caches). A SQLite index in the store directory
+    remembers the source URL, ETag and Last-Modified of each video's thumbnail
+    so later fetches can be conditional requests; every worker process reads
+    and updates it directly, so none of them loses another's entries. Sized
+    variants (THUMBNAIL_VARIANTS) are generated once when a new image is
+    stored. The store is trimmed by total size and by age.
+    """
+
+    def __init__(self, base_dir=THUMBNAILS_DIR, session=None, max_bytes=THUMBNAIL_STORE_MAX_BYTES,
+                 max_age=THUMBNAIL_STORE_MAX_AGE, revalidate_after=THUMBNAIL_REVALIDATE_AFTER):
+        self.base_dir = base_dir
+        self.session = session or http_session
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.revalidate_after = revalidate_after
+        self._db_path = os.path.join(base_dir, 'index.sqlite3')
+        self._legacy_index_path = os.path.join(base_dir, 'index.json') # Imported once, then removed
+        self._db_lock = threading.Lock()
+        self._db = None # Opened on first use, once per process (see _connection)
+        self._db_pid = None
+        self._swept_at = 0.0
+        # Striped per-video locks, so concurrent first requests for one thumbnail download it once
+        self._fetch_locks = [threading.Lock() for _ in range(64)]
+
+    def _relative_path(self, filename):
+        # Path for url_for, relative to the 'static' folder, e.g. 'thumbnails/<file>.jpg'
+        return os.path.join(os.path.basename(self.base_dir), filename)
+
+    def file_path(self, relative_path):
+        """Returns the absolute path of a static-relative path returned by fetch or fetch_variants."""
+        return os.path.join(self.base_dir, os.path.basename(relative_path))
+
+    def source_url(self, video_id):
+        """Returns the URL the stored thumbnail for video_id was fetched from, or None."""
+        record = self._get_record(video_id)
+        return record.get('url') if record else None
+
+    def _open_db(self):
+        try:
+            os.makedirs(self.base_dir, exist_ok=True)
+            db = sqlite3.connect(self._db_path, check_same_thread=False, timeout=5)
+            db.execute('PRAGMA journal_mode=WAL')
+        except (OSError, sqlite3.Error) as e:
+            # Thumbnails still work; the index just is not shared or kept
+            logging.error(f"Could not open thumbnail index {self._db_path}: {e}. Using an in-memory index.")
+            db = sqlite3.connect(':memory:', check_same_thread=False)
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS thumbnails ('
+            'video_id TEXT PRIMARY KEY, filename TEXT NOT NULL, url TEXT, etag TEXT, last_modified TEXT, '
+            'fetched_at REAL NOT NULL, size INTEGER NOT NULL DEFAULT 0)'
+        )
+        db.execute('CREATE INDEX IF NOT EXISTS thumbnails_fetched_at ON thumbnails (fetched_at)')
+        db.commit()
+        self._import_legacy_index(db)
+        self._db_pid = os.getpid()
+        return db
+
+    def _import_legacy_index(self, db):
+        # Carries entries over from the JSON index earlier versions kept
+        if not os.path.exists(self._legacy_index_path):
+            return
+        try:
+            with open(self._legacy_index_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+            with db:
+                db.executemany(
+                    'INSERT OR IGNORE INTO thumbnails (video_id, filename, url, etag, last_modified, fetched_at, size) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(video_id, rec['filename'], rec.get('url'), rec.get('etag'), rec.get('last_modified'),
+                      rec.get('fetched_at', 0), rec.get('size', 0))
+                     for video_id, rec in legacy.items() if rec.get('filename')]
+                )
+            os.remove(self._legacy_index_path)
+        except FileNotFoundError:
+            pass # Imported by another process
+        except (OSError, ValueError, AttributeError, sqlite3.Error) as e:
+            logging.warning(f"Could not import thumbnail index {self._legacy_index_path}: {e}")
+
+    def _connection(self):
+        # Caller holds self._db_lock. A connection inherited across fork() must
+        # not be used, so each process opens its own.
+        if self._db is None or self._db_pid != os.getpid():
+            self._db = self._open_db()
+        return self._db
+
+    def _get_record(self, video_id):
+        try:
+            with self._db_lock:
+                row = self._connection().execute(
+                    'SELECT filename, url, etag, last_modified, fetched_at, size FROM thumbnails WHERE video_id = ?',
+                    (video_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logging.error(f"Thumbnail index read failed for {video_id}: {e}")
+            return None
+        return dict(zip(_INDEX_FIELDS, row)) if row else None
+
+    def _put_record(self, video_id, record, now):
+        """
+        Indexes record for video_id, then evicts expired entries and, oldest
+        first, entries over max_bytes. Returns False if video_id itself was evicted.
+        """
+        evicted = []
+        try:
+            with self._db_lock:
+                db = self._connection()
+                with db: # One transaction, so concurrent processes see a consistent index
+                    db.execute(
+                        'INSERT OR REPLACE INTO thumbnails (video_id, filename, url, etag, last_modified, fetched_at, size) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (video_id,) + tuple(record.get(field) for field in _INDEX_FIELDS)
+                    )
+                    evicted = db.execute('SELECT video_id, filename FROM thumbnails WHERE fetched_at <= ?',
+                                         (now - self.max_age,)).fetchall()
+                    total = db.execute('SELECT COALESCE(SUM(size), 0) FROM thumbnails WHERE fetched_at > ?',
+                                       (now - self.max_age,)).fetchone()[0]
+                    if total > self.max_bytes:
+                        rows = db.execute('SELECT video_id, filename, size FROM thumbnails WHERE fetched_at > ? '
+                                          'ORDER BY fetched_at', (now - self.max_age,)).fetchall()
+                        for evicted_id, filename, size in rows:
+                            if total <= self.max_bytes:
+                                break
+                            evicted.append((evicted_id, filename))
+                            total -= size
+                        logging.info(f"Thumbnail store trimmed to {total} bytes")
+                    db.executemany('DELETE FROM thumbnails WHERE video_id = ?', [(v,) for v, _ in evicted])
+        except sqlite3.Error as e:
+            logging.error(f"Thumbnail index write failed for {video_id}: {e}")
+            return True # The file is on disk; it is just not indexed (the orphan sweep will get to it)
+        for _, filename in evicted:
+            self._remove_file(filename)
+        if now - self._swept_at >= THUMBNAIL_ORPHAN_SWEEP_INTERVAL:
+            self._swept_at = now
+            self._sweep_orphans(now)
+        return all(evicted_id != video_id for evicted_id, _ in evicted)
+
+    def _sweep_orphans(self, now):
+        # Removes stored files no index entry refers to, once past the grace period
+        # (so files another process is about to index are left alone)
+        try:
+            with self._db_lock:
+                filenames = [row[0] for row in self._connection().execute('SELECT filename FROM thumbnails')]
+        except sqlite3.Error as e:
+            logging.error(f"Thumbnail index read failed: {e}")
+            return
+        known = set(filenames)
+        known.update(variant_filename(filename, v) for filename in filenames for v in THUMBNAIL_VARIANTS)
+        removed = 0
+        try:
+            with os.scandir(self.base_dir) as it:
+                for entry in it:
+                    if entry.name in known or not entry.name.endswith('.jpg'):
+                        continue
+                    try:
+                        if now - entry.stat().st_mtime >= THUMBNAIL_ORPHAN_GRACE:
+                            os.remove(entry.path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            logging.warning(f"Error sweeping thumbnail store {self.base_dir}: {e}")
+        if removed:
+            logging.info(f"Removed {removed} unindexed thumbnail files")
+
+    def _remove_file(self, filename):
+        # Removes a stored thumbnail together with its sized variants
+        for name in [filename] + [variant_filename(filename, v) for v in THUMBNAIL_VARIANTS]:
+            path = os.path.join(self.base_dir, name)
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.error(f"Error removing thumbnail {path}: {e}")
+
+    def _stored_size(self, filename):
+        size = 0
+        for name in [filename] + [variant_filename(filename, v) for v in THUMBNAIL_VARIANTS]:
+            path = os.path.join(self.base_dir, name)
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def fetch(self, video_id, url):
+        """
+        Returns the static-relative path of the thumbnail for video_id,
+        downloading it from url only if we do not already hold a valid copy.
+        Returns None if the image could not be fetched.
+        """
+        from PIL import UnidentifiedImageError
+
+        now = time.time()
+        record = self._get_record(video_id) or {}
+        previous_filename = record.get('filename')
+
+        headers = {}
+        if record and record.get('url') == url and os.path.exists(os.path.join(self.base_dir, record['filename'])):
+            if now - record.get('fetched_at', 0) < self.revalidate_after:
+                return self._relative_path(record['filename'])
+            if record.get('etag'):
+                headers['If-None-Match'] = record['etag']
+            if record.get('last_modified'):
+                headers['If-Modified-Since'] = record['last_modified']
+        else:
+            record = {}
+
+        try:
+            response = fetch_image_bytes(url, headers=headers, session=self.session)
+            if response.status_code == 304 and record:
+                record['fetched_at'] = now
+                logging.info(f"Thumbnail for {video_id} not modified; reusing {record['filename']}")
+            else:
+                content = response.content
+                content_hash = hashlib.sha256(content).hexdigest()[:16]
+                is_gif = content[:6] in (b'GIF87a', b'GIF89a')
+                filename = f"{video_id}_{content_hash}.{'gif' if is_gif else 'jpg'}"
+                save_path = os.path.join(self.base_dir, filename)
+                if not os.path.exists(save_path):
+                    write_image(content, save_path)
+                    make_variants(save_path)
+                    logging.info(f"Thumbnail for {video_id} saved to {save_path}")
+                if previous_filename and previous_filename != filename:
+                    self._remove_file(previous_filename)
+                record = {
+                    'filename': filename,
+                    'url': url,
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                    'fetched_at': now,
+                    'size': self._stored_size(filename),
+                }
+        except (requests.exceptions.RequestException, UpstreamUnavailable) as e:
+            if record:
+                # Revalidation failed; the copy we hold is still better than nothing
+                logging.warning(f"Could not revalidate thumbnail for {video_id} ({e}); serving the stored copy.")
+                return self._relative_path(record['filename'])
+            logging.error(f"Request failed for {url}: {e}")
+            return None
+        except UnidentifiedImageError:
+            logging.error(f"Cannot identify image file from {url}. It might be corrupted or not an image.")
+            return None
+        except (ValueError, IOError) as e: # Broader exception for image processing/saving issues
+            logging.error(f"Image processing or saving failed for {url}: {e}")
+            return None
+
+        if not self._put_record(video_id, record, now): # Evicted straight away (store too small for it)
+            return None
+        return self._relative_path(record['filename'])
+
+    def fetch_variants(self, video_id, url):
+        """
+        Like fetch, but returns {'original': path, <variant>: path, ...} with
+        static-relative paths, generating any variant that is missing.
+        Returns None if the image could not be fetched.
+        """
+        with self._fetch_locks[hash(video_id) % len(self._fetch_locks)]:
+            return self._fetch_variants(video_id, url)
+
+    def _fetch_variants(self, video_id, url):
+        from PIL import UnidentifiedImageError
+
+        relative_path = self.fetch(video_id, url)
+        if not relative_path:
+            return None
+        paths = variant_paths(relative_path)
+        source_path = os.path.join(self.base_dir, os.path.basename(relative_path))
+        if not all(os.path.exists(os.path.join(self.base_dir, os.path.basename(p))) for p in paths.values()):
+            try:
+                make_variants(source_path)
+            except (UnidentifiedImageError, ValueError, IOError) as e:
+                logging.error(f"Could not create thumbnail variants for {video_id}: {e}")
+                return {'original': relative_path}
+        paths['original'] = relative_path
+        return paths
@@ -1,15 +1,184 @@
-import os
-import requests
-from youtubesearchpython import VideosSearch
-import yt_dlp
 import time
-from PIL import Image, UnidentifiedImageError
 from datetime import datetime, timedelta
 import concurrent.futures
+import contextlib
+import contextvars
 import logging
+import queue
+import re
+import threading
 
-# Configure basic logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# yt_dlp, youtubesearchpython, pandas and numpy are imported where they
+# are first used rather than here; together they are most of the app's startup time
+from .cache_utils import VideoDetailsCache
+from .models import VideoRecord, TopK
+from .snapshot_utils import SnapshotStore
+from .metrics_utils import timed, record_stage
+from .ratelimit_utils import UpstreamUnavailable, search_upstream, fanout_search_upstream, ytdlp_upstream
+from .thumbnail_utils import ThumbnailStore
+
+# Defaults for the concurrent extraction stage of search_youtube.
+# EXTRACTION_WORKERS bounds how many yt-dlp extractions run at once,
+# VIDEO_TIMEOUT_SECONDS caps a single video and REQUEST_DEADLINE_SECONDS
+# caps the whole extraction stage of one search.
+EXTRACTION_WORKERS = 8
+VIDEO_TIMEOUT_SECONDS = 20
+REQUEST_DEADLINE_SECONDS = 45
+
+# Search modes. 'combined' runs one search for all keywords joined with OR;
+# 'fanout' runs one search per keyword concurrently (up to FANOUT_SEARCH_WORKERS
+# at once, each paging through at most FANOUT_MAX_PAGES result pages, under
+# the fan-out search rate limit) and merges the candidates round-robin before extraction.
+SEARCH_MODE_COMBINED = 'combined'
+SEARCH_MODE_FANOUT = 'fanout'
+SEARCH_MODES = (SEARCH_MODE_COMBINED, SEARCH_MODE_FANOUT)
+FANOUT_SEARCH_WORKERS = 8
+FANOUT_MAX_PAGES = 2
+
+# Ranking modes. 'recent' sorts newest first, then by engagement score;
+# 'velocity' sorts by current views per hour, then by acceleration, both
+# computed from the count snapshots in the snapshot store.
+RANKING_RECENT = 'recent'
+RANKING_VELOCITY = 'velocity'
+RANKINGS = (RANKING_RECENT, RANKING_VELOCITY)
+
+
+class SearchFailed(Exception):
+    """Raised when the YouTube search itself errors, so a failed search is not mistaken for one with no results."""
+
+# Shared minimal option set for the pooled yt-dlp instances. We only extract
+# metadata, so nothing is downloaded and nothing is printed.
+YDL_OPTS = {
+    'quiet': True,
+    'no_warnings': True,
+    'skip_download': True,
+    'format': 'best',
+    'socket_timeout': VIDEO_TIMEOUT_SECONDS,
+}
+# A pooled YoutubeDL is closed and replaced after this many extractions
+YDL_MAX_USES = 100
+
+
+class YoutubeDLPool:
+    """
+    A pool of long-lived yt_dlp.YoutubeDL instances.
+
+    Building a YoutubeDL registers every extractor, parses the options and sets
+    up an HTTP session, so we do it once per pooled instance instead of once per
+    video. An instance is only ever used by the thread that checked it out.
+    It is recycled (closed, and rebuilt lazily on a later checkout) after
+    max_uses extractions or as soon as an extraction raises.
+    """
+
+    def __init__(self, size, ydl_opts, max_uses=YDL_MAX_USES):
+        self.size = size
+        self.max_uses = max_uses
+        self._ydl_opts = dict(ydl_opts)
+        self._idle = queue.LifoQueue() # LIFO keeps the warmest instances in use
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _create(self):
+        import yt_dlp
+        return {'ydl': yt_dlp.YoutubeDL(self._ydl_opts), 'uses': 0}
+
+    def _close(self, entry):
+        try:
+            entry['ydl'].close()
+        except Exception as e:
+            logging.warning(f"Error closing pooled YoutubeDL instance: {e}")
+
+    @contextlib.contextmanager
+    def checkout(self):
+        """Checks an instance out of the pool for the duration of the with block."""
+        self._slots.acquire()
+        try:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                entry = self._create()
+
+            failed = False
+            try:
+                yield entry['ydl']
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                entry['uses'] += 1
+                if failed or entry['uses'] >= self.max_uses:
+                    self._close(entry)
+                else:
+                    self._idle.put(entry)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Closes every idle instance; instances checked out right now are closed on check-in."""
+        while True:
+            try:
+                self._close(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+# Process-wide pool used by get_video_details
+_ydl_pool = YoutubeDLPool(EXTRACTION_WORKERS, YDL_OPTS)
+
+# Process-wide cache of per-video details, keyed by canonical video ID
+_video_cache = VideoDetailsCache()
+
+# Process-wide thumbnail store under static/thumbnails, keyed by video ID and content hash
+_thumbnail_store = ThumbnailStore()
+
+# Process-wide store of view/like/comment count snapshots, fed by every fresh fetch
+_snapshot_store = SnapshotStore()
+
+def VideosSearch(*args, **kwargs):
+    """youtubesearchpython.VideosSearch, imported on the first search (it pulls in yt_dlp's extractors)."""
+    from youtubesearchpython import VideosSearch as _VideosSearch
+    return _VideosSearch(*args, **kwargs)
+
+# Matches the 11-character video ID in watch, youtu.be, shorts and embed URLs
+_VIDEO_ID_RE = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([A-Za-z0-9_-]{11})')
+
+def extract_video_id(video_url):
+    """Returns the canonical YouTube video ID for a video URL, or None if there isn't one."""
+    if not video_url:
+        return None
+    match = _VIDEO_ID_RE.search(video_url)
+    return match.group(1) if match else None
+
+# Matches a bare video ID, as used in /thumb/<video_id>
+_VIDEO_ID_ONLY_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+
+# Thumbnail URL used when we know nothing else about a video
+DEFAULT_THUMBNAIL_URL = 'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg'
+
+def thumbnail_file(video_id, variant='original', url=None):
+    """
+    Returns the local path of a video's thumbnail, or of one of its sized
+    variants (thumbnail_utils.THUMBNAIL_VARIANTS), fetching and resizing it
+    into the thumbnail store on first use. The image comes from url, else
+    from where the stored copy came from, else from the cached video details'
+    thumbnail URL, else from YouTube's default thumbnail URL.
+    Returns None for an invalid video ID or if the image cannot be fetched.
+    """
+    if not video_id or not _VIDEO_ID_ONLY_RE.match(video_id):
+        return None
+    if not url or not url.startswith(('http://', 'https://')):
+        url = _thumbnail_store.source_url(video_id)
+    if not url:
+        cached = _video_cache.peek(video_id) # Not counted in the cache stats
+        url = cached.thumbnail if cached else None
+        if not url or not url.startswith(('http://', 'https://')):
+            url = DEFAULT_THUMBNAIL_URL.format(video_id=video_id)
+    paths = _thumbnail_store.fetch_variants(video_id, url)
+    relative_path = paths.get(variant) if paths else None
+    return _thumbnail_store.file_path(relative_path) if relative_path else None
+
+def get_cache_stats():
+    """Returns hit/miss/eviction counters for the video details cache."""
+    return _video_cache.stats()
 
 def format_duration(seconds):
     """Formats duration from seconds to HH:MM:SS or MM:SS."""
@@ -23,119 +192,61 @@ def format_duration(seconds):
     else:
         return f"{minutes:02}:{secs:02}"
 
-def download_image(url, base_save_dir, filename):
-    """Downloads an image, saves it, and returns its relative path for static serving."""
-    if not os.path.exists(base_save_dir):
-        os.makedirs(base_save_dir)
-    
-    save_path = os.path.join(base_save_dir, filename)
-    # Path for url_for should be relative to the 'static' folder.
-    # Assuming base_save_dir is 'flask_youtube_app/static/thumbnails',
-    # then relative_path will be 'thumbnails/filename.jpg'
-    relative_path = os.path.join(os.path.basename(base_save_dir), filename)
+def get_video_details(video_url, use_cache=True, on_start=None):
+    """
+    Returns detailed information for a single YouTube video.
+    Served from the video details cache when possible; otherwise fetched with yt-dlp.
+    on_start, if given, is called once the yt-dlp extraction actually starts,
+    i.e. after any wait for a pooled YoutubeDL; it is not called for cache hits.
+    """
+    with timed('video_details') as outcome:
+        video_id = extract_video_id(video_url)
+        if not use_cache or not video_id:
+            details = _fetch_and_snapshot(video_url, video_id, on_start)
+        else:
+            details = _video_cache.get(video_id, lambda: _fetch_and_snapshot(video_url, video_id, on_start))
+        outcome['success'] = details is not None
+    return details
 
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        img = Image.open(requests.get(url, stream=True).raw)
-        
-        # Verify image (basic check)
-        if img.format.lower() not in ['jpeg', 'png', 'gif', 'webp']: # Added webp
-            logging.warning(f"Downloaded image from {url} is not in a standard web format (JPEG, PNG, GIF, WEBP): format is {img.format}")
-            # Still try to save it if it's a valid image format Pillow supports
-            # but log a warning.
-
-        # Ensure the image is in RGB mode for saving as JPEG, if it's not animated
-        if img.format.lower() != 'gif': # Don't convert GIF to RGB if we want to preserve animation
-             img = img.convert("RGB")
-        
-        img.save(save_path, "JPEG" if img.format.lower() != 'gif' else "GIF") # Save as JPEG or GIF
-        logging.info(f"Image successfully downloaded and saved to {save_path}")
-        return relative_path
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed for {url}: {e}")
-    except UnidentifiedImageError:
-        logging.error(f"Cannot identify image file from {url}. It might be corrupted or not an image.")
-    except (ValueError, IOError) as e: # Broader exception for image processing/saving issues
-        logging.error(f"Image processing or saving failed for {url}: {e}")
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while downloading image {url}: {e}")
-    
-    # Cleanup if save_path was created but failed
-    if os.path.exists(save_path):
+def _fetch_and_snapshot(video_url, video_id, on_start=None):
+    """_fetch_video_details, also recording the fresh counts in the snapshot store."""
+    details = _fetch_video_details(video_url, on_start)
+    if details and video_id:
         try:
-            os.remove(save_path)
-        except OSError as e_remove:
-            logging.error(f"Error trying to remove partially downloaded file {save_path}: {e_remove}")
-            
-    return None
-
-
-def get_video_details(video_url):
-    """Fetches detailed information for a single YouTube video using yt-dlp."""
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'skip_download': True,
-        'format': 'best',
-        'forcejson': True, # Not a standard yt-dlp option, but we parse the json output
-        'dump_single_json': True, # Gets info as a single JSON line
-    }
+            _snapshot_store.record(video_id, details.views, details.likes, details.comments)
+        except Exception as e:
+            # Snapshots feed the velocity ranking; losing one must not lose the fetched video
+            logging.error(f"Could not record a count snapshot for {video_id}: {e}")
+    return details
+
+def _extract_info(video_url, on_start=None):
+    """One yt-dlp extraction attempt, holding a pooled YoutubeDL for just the extraction."""
+    with _ydl_pool.checkout() as ydl:
+        if on_start is not None:
+            on_start()
+        return ydl.extract_info(video_url, download=False)
+
+def _fetch_video_details(video_url, on_start=None):
+    """Fetches detailed information for a single YouTube video using yt-dlp, as a VideoRecord."""
+    import yt_dlp
+
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(video_url, download=False)
-            
+        with timed('ytdlp_extract'):
+            # The circuit check, rate limit wait and retry backoff all happen
+            # outside the pool, so they never hold a YoutubeDL slot
+            info_dict = ytdlp_upstream.call(_extract_info, video_url, on_start)
+
             # Basic check if info_dict is what we expect
             if not info_dict:
                 logging.error(f"yt-dlp returned empty info for {video_url}")
                 return None
 
-            upload_date_str = info_dict.get('upload_date')
-            upload_date_yt = info_dict.get('upload_date') # Format YYYYMMDD
-            formatted_date = "N/A"
-            upload_datetime_obj = None # This will be our datetime object for upload_timestamp
-
-            if upload_date_yt:
-                try:
-                    upload_datetime_obj = datetime.strptime(upload_date_yt, "%Y%m%d")
-                    formatted_date = upload_datetime_obj.strftime("%d/%m/%Y")
-                except (ValueError, TypeError) as e:
-                    logging.warning(f"Could not parse upload date '{upload_date_yt}' for {video_url}: {e}. Setting to N/A.")
-                    # upload_datetime_obj remains None, formatted_date remains "N/A"
-            
-            views = info_dict.get('view_count', 0) or 0
-            likes = info_dict.get('like_count', 0) or 0
-            comments = info_dict.get('comment_count', 0) or 0
-            
-            # Ensure they are integers
-            try:
-                views = int(views)
-            except (ValueError, TypeError):
-                views = 0
-            try:
-                likes = int(likes)
-            except (ValueError, TypeError):
-                likes = 0
-            try:
-                comments = int(comments)
-            except (ValueError, TypeError):
-                comments = 0
-
-            engagement_score = views + (likes * 2) + (comments * 3)
-
-            return {
-                "title": info_dict.get('title', "N/A"),
-                "url": video_url, # Use the passed video_url directly
-                "channel_name": info_dict.get('uploader', "N/A"),
-                "views": views,
-                "duration_seconds": info_dict.get('duration'), 
-                "likes": likes,
-                "comments": comments,
-                "date": formatted_date, 
-                "upload_timestamp": upload_datetime_obj, # datetime object or None
-                "thumbnail": info_dict.get('thumbnail', "N/A"), # URL of the thumbnail
-                "engagement_score": engagement_score
-            }
+            # Parsing and validation of the counts and dates happen once, here
+            return VideoRecord.from_info(info_dict, video_url)
+    except UpstreamUnavailable as e:
+        # Shed by the rate limiter / circuit breaker; the cache serves a stale copy if it has one
+        logging.warning(f"Skipping yt-dlp extraction for {video_url}: {e}")
+        return None
     except yt_dlp.utils.DownloadError as e:
         # Specific yt-dlp download errors (e.g., video unavailable)
         logging.error(f"yt-dlp DownloadError for {video_url}: {e}")
@@ -151,10 +262,280 @@ def is_within_last_24_hours(upload_timestamp):
         return False
     return (datetime.now() - datetime.fromtimestamp(upload_timestamp)) < timedelta(hours=24)
 
-def search_youtube(keywords, max_results=20):
+def _iter_video_details(video_urls, max_results, workers, video_timeout, deadline):
     """
-    Searches YouTube for videos based on keywords and fetches their details.
-    Downloads thumbnails to a static directory.
+    Runs get_video_details for video_urls on a bounded thread pool and yields
+    (candidate_index, details) for every good record as soon as it arrives.
+
+    The stage stops early once the first max_results good records in candidate
+    (search) order are known; remaining candidates are cancelled, or ignored if
+    they are already running. A record yielded before that point may fall
+    outside the first max_results, so callers keep the max_results lowest
+    indices (see iter_search_youtube) to stay deterministic.
+    A video whose extraction has been running for video_timeout seconds is
+    treated as failed; the clock starts when it gets a pooled YoutubeDL, so
+    time spent queued behind other searches' extractions does not count. Once the deadline (seconds, for the whole stage) passes the stage ends with
+    whatever has been collected so far.
+    """
+    results = [None] * len(video_urls)
+    resolved = [False] * len(video_urls)
+    running = {} # candidate index -> extraction start time (None until it starts), while _run is running
+    running_lock = threading.Lock()
+    completed = queue.Queue() # (candidate index, details, exception) as extractions finish
+
+    def _run(idx, url):
+        def started():
+            with running_lock:
+                if idx in running and running[idx] is None:
+                    running[idx] = time.monotonic()
+
+        with running_lock:
+            running[idx] = None
+        try:
+            completed.put((idx, get_video_details(url, on_start=started), None))
+        except Exception as exc:
+            completed.put((idx, None, exc))
+        finally:
+            with running_lock:
+                running.pop(idx, None)
+
+    deadline_at = time.monotonic() + deadline if deadline else None
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+    for idx, url in enumerate(video_urls):
+        # Each worker runs in a copy of this context, so its stage timings count towards this request
+        executor.submit(contextvars.copy_context().run, _run, idx, url)
+    outstanding = len(video_urls)
+
+    # prefix_end is the first candidate that has not resolved yet; prefix_good
+    # counts the good records before it. Once prefix_good reaches max_results
+    # no later candidate can change the outcome.
+    prefix_end = 0
+    prefix_good = 0
+    try:
+        while outstanding:
+            while prefix_end < len(resolved) and resolved[prefix_end]:
+                if results[prefix_end]:
+                    prefix_good += 1
+                prefix_end += 1
+            if prefix_good >= max_results:
+                break
+
+            now = time.monotonic()
+            if deadline_at is not None and now >= deadline_at:
+                logging.warning(f"Extraction deadline of {deadline}s reached with {outstanding} video(s) still pending; using partial results.")
+                break
+
+            # Give up on videos that have been running for longer than video_timeout.
+            # Only running extractions are checked, so this is bounded by the worker count.
+            wait_timeout = 1.0
+            timed_out = False
+            with running_lock:
+                running_now = list(running.items())
+            for idx, started in running_now:
+                if started is None or resolved[idx]:
+                    continue
+                remaining = started + video_timeout - now
+                if remaining <= 0:
+                    resolved[idx] = True
+                    outstanding -= 1
+                    timed_out = True
+                    logging.warning(f"Timed out after {video_timeout}s fetching details for {video_urls[idx]}")
+                else:
+                    wait_timeout = min(wait_timeout, remaining)
+            if timed_out:
+                continue # Re-check the prefix before waiting again
+            if deadline_at is not None:
+                wait_timeout = min(wait_timeout, max(0.0, deadline_at - now))
+
+            try:
+                idx, details, exc = completed.get(timeout=wait_timeout)
+            except queue.Empty:
+                continue
+            if resolved[idx]: # Already given up on (timed out)
+                continue
+            resolved[idx] = True
+            outstanding -= 1
+            results[idx] = details
+            if exc is not None:
+                logging.error(f"Detail extraction raised an exception for {video_urls[idx]}: {exc}")
+            if details:
+                yield idx, details
+            else:
+                logging.warning(f"Could not fetch details for {video_urls[idx]}")
+    finally:
+        # Do not wait for stragglers; queued candidates are cancelled and
+        # running ones finish in the background (bounded by the socket timeout).
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _iter_candidate_urls(query, limit, max_pages=1, upstream=search_upstream):
+    """
+    Runs the YouTube search and yields the link of each result, in search order.
+    Pages through up to max_pages result pages until limit links are found.
+    Every request goes through upstream's rate limit and circuit breaker.
+    Raises UpstreamUnavailable if the search upstream is shedding load and
+    SearchFailed if the search errors; a later page failing keeps the pages so far.
+    """
+    with timed('search') as outcome:
+        try:
+            # Perform the search (the request happens in the constructor)
+            search = upstream.call(VideosSearch, query, limit=limit)
+            results = list(search.result()['result'])
+        except UpstreamUnavailable:
+            outcome['success'] = False
+            raise
+        except Exception as e:
+            logging.error(f"Error during YouTube search with youtubesearchpython: {e}")
+            outcome['success'] = False
+            raise SearchFailed(f"YouTube search for {query} failed: {e}") from e
+
+        pages = 1
+        while results and len(results) < limit and pages < max_pages:
+            try:
+                if not upstream.call(search.next):
+                    break
+                page = search.result()['result']
+            except Exception as e: # Includes UpstreamUnavailable; keep the pages we have
+                logging.warning(f"Error fetching page {pages + 1} of search results for query {query}: {e}")
+                break
+            if not page:
+                break
+            results.extend(page)
+            pages += 1
+    if not results:
+        logging.info(f"No direct search results for query: {query}")
+        return
+
+    for video_res in results[:limit]:
+        video_url = video_res.get('link')
+        if video_url:
+            yield video_url
+        else:
+            logging.warning(f"Search result missing 'link': {video_res.get('title', 'N/A')}")
+
+def _dedupe_candidates(video_urls, limit):
+    """Drops repeated videos (by video ID, or URL when there is none) and returns the first limit URLs."""
+    seen = set()
+    unique_urls = []
+    for video_url in video_urls:
+        key = extract_video_id(video_url) or video_url
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_urls.append(video_url)
+        if len(unique_urls) >= limit:
+            break
+    return unique_urls
+
+def _fanout_candidate_urls(keywords_list, limit):
+    """
+    Searches every keyword on its own, concurrently, and merges the results
+    round-robin (first result of each keyword, then the second, ...) so each
+    keyword gets a fair share of the limit candidates. Duplicates are dropped
+    before anything is extracted. A keyword whose search fails contributes no
+    candidates; if every keyword fails, the last error is raised
+    (UpstreamUnavailable in preference to SearchFailed, as it is worth retrying).
+    """
+    # Each keyword fetches its share plus as much again, to make up for overlap with the others
+    per_keyword = min(limit, 2 * -(-limit // len(keywords_list)))
+    workers = min(FANOUT_SEARCH_WORKERS, len(keywords_list))
+    with timed('fanout_search'), concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        # The generators only start running (and searching) inside the worker threads,
+        # each in a copy of this context so its stage timings count towards this request
+        futures = [
+            executor.submit(contextvars.copy_context().run, list,
+                            _iter_candidate_urls(f'"{keyword}"', per_keyword, FANOUT_MAX_PAGES,
+                                                 fanout_search_upstream))
+            for keyword in keywords_list
+        ]
+        per_keyword_urls = []
+        unavailable = None
+        failed = None
+        for keyword, future in zip(keywords_list, futures):
+            try:
+                per_keyword_urls.append(future.result())
+            except UpstreamUnavailable as e:
+                logging.warning(f"Search for keyword '{keyword}' skipped: {e}")
+                unavailable = e
+                per_keyword_urls.append([])
+            except Exception as e:
+                logging.error(f"Search for keyword '{keyword}' failed: {e}")
+                failed = e
+                per_keyword_urls.append([])
+    if not any(per_keyword_urls):
+        if unavailable is not None:
+            raise unavailable
+        if failed is not None:
+            raise failed if isinstance(failed, SearchFailed) else SearchFailed(f"YouTube search failed: {failed}")
+
+    merged = (
+        urls[position]
+        for position in range(max((len(urls) for urls in per_keyword_urls), default=0))
+        for urls in per_keyword_urls
+        if position < len(urls)
+    )
+    return _dedupe_candidates(merged, limit)
+
+def _rank_by_velocity(detailed_videos, max_results, now=None):
+    """
+    Sorts detail records by views per hour, then acceleration, and returns the
+    top max_results, each with views_per_hour and acceleration set.
+    Videos with fewer than two snapshots fall back to their average views per
+    hour since upload, and no acceleration.
+    """
+    import numpy as np
+    import pandas as pd
+
+    now = time.time() if now is None else now
+    video_ids = [extract_video_id(video.url) or video.url for video in detailed_videos]
+    metrics = _snapshot_store.trend_metrics(video_ids, now=now).reindex(video_ids)
+
+    candidates = pd.DataFrame({
+        'views': [video.views for video in detailed_videos],
+        'uploaded': pd.to_datetime([video.upload_timestamp for video in detailed_videos]),
+    })
+    uploaded_at = (candidates['uploaded'] - pd.Timestamp(0)).dt.total_seconds() # NaN without an upload date
+    age_hours = ((now - uploaded_at) / 3600.0).clip(lower=1.0)
+    views_per_hour = metrics['views_per_hour'].to_numpy()
+    views_per_hour = np.where(np.isnan(views_per_hour), (candidates['views'] / age_hours).to_numpy(), views_per_hour)
+    acceleration = np.nan_to_num(metrics['acceleration'].to_numpy(dtype=np.float64), nan=0.0)
+
+    # lexsort sorts by its last key first; NaN velocities (no upload date either) go last
+    order = np.lexsort((-acceleration, -np.nan_to_num(views_per_hour, nan=-np.inf)))[:max_results]
+    top_videos = []
+    for idx in order:
+        video = detailed_videos[idx]
+        video.views_per_hour = None if np.isnan(views_per_hour[idx]) else float(views_per_hour[idx])
+        video.acceleration = float(acceleration[idx])
+        top_videos.append(video)
+    return top_videos
+
+def _rank_videos(detailed_videos, max_results, ranking=RANKING_RECENT):
+    """
+    Returns the top max_results records, newest first, then by engagement.
+    With the 'velocity' ranking, see _rank_by_velocity instead.
+    """
+    if ranking == RANKING_VELOCITY:
+        return _rank_by_velocity(detailed_videos, max_results)
+    # VideoRecord.sort_key is (upload_timestamp, engagement_score), with a
+    # missing upload date treated as oldest; a bounded heap keeps the top max_results
+    top = TopK(max_results, key=lambda video: video.sort_key)
+    for video in detailed_videos:
+        top.push(video)
+    return top.items()
+
+def iter_search_youtube(keywords, max_results=20, workers=EXTRACTION_WORKERS,
+                        video_timeout=VIDEO_TIMEOUT_SECONDS, deadline=REQUEST_DEADLINE_SECONDS,
+                        mode=SEARCH_MODE_COMBINED, ranking=RANKING_RECENT):
+    """
+    Generator form of search_youtube that reports progress as it goes.
+    Yields (event, payload) tuples:
+      ('video', details)    as each video's details arrive; a video may still be
+                            dropped by the final selection
+      ('ranked', videos)    once the final top videos are chosen, in display order
+      ('done', videos)      last, with the same list as 'ranked' (possibly empty)
+    Raises ratelimit_utils.UpstreamUnavailable, before any video is yielded, if
+    the YouTube search is being shed (rate limited or circuit open), and
+    SearchFailed, also before any video, if the search errors.
     """
     if isinstance(keywords, str): # Ensure keywords is a list
         keywords_list = [k.strip() for k in keywords.split(",") if k.strip()]
@@ -162,116 +543,69 @@ def search_youtube(keywords, max_results=20):
         keywords_list = keywords
     else:
         logging.error("Keywords must be a string or a list of strings.")
-        return []
+        yield 'done', []
+        return
 
     if not keywords_list:
         logging.warning("Search initiated with no keywords.")
-        return []
+        yield 'done', []
+        return
         
     query = " OR ".join(f'"{k}"' for k in keywords_list) # Search for exact phrases or combine
-    logging.info(f"Searching YouTube with query: {query}, max_results: {max_results}")
-
-    videos_data = []
-    try:
-        # Perform the search
-        search = VideosSearch(query, limit=max_results * 2) # Fetch more to filter later
-        results = search.result()['result']
-        
-        if not results:
-            logging.info(f"No direct search results for query: {query}")
-            return []
-
-    except Exception as e:
-        logging.error(f"Error during YouTube search with youtubesearchpython: {e}")
-        return [] # Return empty list on search failure
+    logging.info(f"Searching YouTube ({mode}) with query: {query}, max_results: {max_results}")
 
-    # Prepare for fetching details and thumbnails
-    # Ensure the static thumbnails directory exists
-    # Corrected path to be relative to the application root for os.makedirs
-    # but download_image will use it to construct static-relative paths for return
-    base_app_dir = os.path.dirname(os.path.abspath(__file__)) # flask_youtube_app
-    static_thumbnails_dir = os.path.join(base_app_dir, 'static', 'thumbnails')
-
-    if not os.path.exists(static_thumbnails_dir):
-        try:
-            os.makedirs(static_thumbnails_dir)
-            logging.info(f"Created directory: {static_thumbnails_dir}")
-        except OSError as e:
-            logging.error(f"Failed to create directory {static_thumbnails_dir}: {e}")
-            # If directory creation fails, we might not be able to save thumbnails
-            # but we can still proceed and try to return video data without them.
-
-    detailed_videos = []
-    # Fetch details for each video using yt-dlp (can be slow, consider concurrent execution)
-    # For now, sequential for simplicity in this step
-    for video_res in results:
-        if len(detailed_videos) >= max_results:
-            break
-        video_url = video_res.get('link')
-        if video_url:
-            details = get_video_details(video_url)
-            if details:
-                detailed_videos.append(details)
-            else:
-                logging.warning(f"Could not fetch details for {video_url}")
-        else:
-            logging.warning(f"Search result missing 'link': {video_res.get('title', 'N/A')}")
+    # Fetch more candidates than needed to filter later
+    if mode == SEARCH_MODE_FANOUT:
+        video_urls = _fanout_candidate_urls(keywords_list, max_results * 2)
+    else:
+        video_urls = _dedupe_candidates(_iter_candidate_urls(query, max_results * 2), max_results * 2)
+    if not video_urls:
+        yield 'done', []
+        return
 
+    # Fetch details for each video using yt-dlp, concurrently and in candidate order.
+    # Stage timings leave out the time spent suspended at a yield (i.e. in the consumer).
+    # The selection is the first max_results videos in candidate order; a bounded heap
+    # on the candidate index keeps just those as the details arrive
+    selected = TopK(max_results, key=lambda item: -item[0])
+    stage_started = time.perf_counter()
+    paused = 0.0
+    for idx, details in _iter_video_details(video_urls, max_results, workers, video_timeout, deadline):
+        selected.push((idx, details))
+        paused_at = time.perf_counter()
+        yield 'video', details
+        paused += time.perf_counter() - paused_at
+    detailed_videos = [details for _, details in selected.items()]
+    record_stage('extract', time.perf_counter() - stage_started - paused, success=bool(detailed_videos))
 
     if not detailed_videos:
         logging.info(f"No video details could be fetched for the search query: {query}")
-        return []
-        
-    # Sort by upload date (newest first) and then by view count
-    # Sort by upload_timestamp (actual datetime objects, None will be handled by sort)
-    # and then by engagement_score. Datetime objects can be compared directly.
-    # To handle None for upload_timestamp (e.g. make them appear older), we can use a lambda
-    # that returns a very old date for None, or filter them out/handle separately if needed.
-    # For simplicity, Python's sort is stable with Nones if they are comparable or
-    # if we provide a key that handles it.
-    # Sorting by datetime object (upload_timestamp) descending, then engagement_score descending.
-    # Using a large datetime for None in timestamp to push them to the end if sorting ascending,
-    # or a very small (old) datetime if sorting descending for "newest first".
-    # min_datetime can be datetime.min, but that might not be timezone-aware if others are.
-    # Since we want newest first, None should be treated as "oldest".
-    min_dummy_date = datetime.min
-    detailed_videos.sort(key=lambda x: (x.get('upload_timestamp', min_dummy_date) or min_dummy_date, x.get('engagement_score', 0) or 0), reverse=True)
-    top_videos = detailed_videos[:max_results]
-
-
-    # Download thumbnails concurrently
-    # The download_image function now expects base_save_dir and a unique filename
-    # and returns a path relative to 'static/' for use in url_for
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_video_idx = {}
-        for idx, video_detail in enumerate(top_videos):
-            # Use 'thumbnail' (which now holds the URL) for downloading
-            if video_detail.get('thumbnail') and video_detail['thumbnail'] != "N/A":
-                original_thumbnail_url = video_detail['thumbnail'] # This is the URL
-                video_id_part = video_detail['url'].split('v=')[-1].split('&')[0] # Basic way to get ID
-                thumbnail_filename = f"thumbnail_{video_id_part}_{idx}.jpg"
-                
-                # Submit to executor
-                future = executor.submit(download_image, original_thumbnail_url, static_thumbnails_dir, thumbnail_filename)
-                future_to_video_idx[future] = idx
-            else:
-                # If no original URL, set the 'thumbnail' field (path) to None
-                top_videos[idx]['thumbnail'] = None 
-                logging.warning(f"Video '{video_detail['title']}' has no original thumbnail URL to download.")
+        yield 'done', []
+        return
 
-        for future in concurrent.futures.as_completed(future_to_video_idx):
-            idx = future_to_video_idx[future]
-            try:
-                relative_thumbnail_path = future.result() # This is 'thumbnails/filename.jpg' or None
-                # Overwrite the 'thumbnail' field (which was the URL) with the local path
-                top_videos[idx]['thumbnail'] = relative_thumbnail_path 
-                if relative_thumbnail_path:
-                    logging.info(f"Thumbnail for '{top_videos[idx]['title']}' processed. Path: {relative_thumbnail_path}")
-                else:
-                    logging.warning(f"Thumbnail download failed for '{top_videos[idx]['title']}'. Original URL was {top_videos[idx].get('thumbnail')}") # Log original URL if download failed
-            except Exception as exc:
-                logging.error(f"Thumbnail processing generated an exception for video '{top_videos[idx]['title']}': {exc}")
-                top_videos[idx]['thumbnail'] = None # Ensure 'thumbnail' is None on error
-    
+    with timed('rank'):
+        top_videos = _rank_videos(detailed_videos, max_results, ranking)
+    yield 'ranked', top_videos
+
+    # Thumbnails are not fetched here; /thumb/<video_id> fetches each one when it is first requested
     logging.info(f"Returning {len(top_videos)} videos after processing for query: {query}")
+    yield 'done', top_videos
+
+def search_youtube(keywords, max_results=20, workers=EXTRACTION_WORKERS,
+                   video_timeout=VIDEO_TIMEOUT_SECONDS, deadline=REQUEST_DEADLINE_SECONDS,
+                   mode=SEARCH_MODE_COMBINED, ranking=RANKING_RECENT):
+    """
+    Searches YouTube for videos based on keywords and fetches their details.
+    Each video's thumbnail field keeps the upstream URL; see thumbnail_file.
+    Details are extracted concurrently with up to `workers` threads; see
+    _iter_video_details for how video_timeout and deadline apply. `mode` is
+    one of SEARCH_MODES and picks how keywords become search queries;
+    `ranking` is one of RANKINGS and picks how the results are ordered.
+    Raises ratelimit_utils.UpstreamUnavailable while YouTube search is unavailable
+    and SearchFailed if it errors; an empty list means the search found nothing usable.
+    """
+    top_videos = []
+    for event, payload in iter_search_youtube(keywords, max_results, workers, video_timeout, deadline, mode, ranking):
+        if event == 'done':
+            top_videos = payload
     return top_videos